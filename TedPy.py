@@ -7,7 +7,6 @@ import re
 import time
 import json
 import importlib
-import html.parser
 
 from tkinter import *
 from tkinter.filedialog import *
@@ -18,6 +17,24 @@ from tkinter.scrolledtext import ScrolledText
 
 this_dir = os.path.dirname(__file__)
 
+import brackets
+import gutter
+import htmllexer
+import lexer
+import fileformat
+import filereplace
+import filesearch
+import lineindex
+import matches
+import outline
+import renderer
+import sandbox
+import scheduler
+import scriptindex
+import symbols
+import trigrams
+import walker
+import workers
 import translation
 translation.language = 'fr'
 _ = translation.translate
@@ -50,6 +67,24 @@ with open(os.path.join(this_dir, 'themes', theme + '.json'),
 # parameters
 history_size = 8 # number of files in history
 wheel_coeff = 2 # increase wheel scrolling
+highlight_slice = 0.02 # seconds of highlighting before giving control to Tk
+highlight_margin = 50 # lines highlighted after the visible ones
+line_cache_size = 100000 # lines whose tokens are kept by each editor
+html_cache_size = 10 # versions of HTML documents whose tokens are kept
+
+# directory of the indices kept between sessions
+cache_dir = os.path.join(this_dir, 'cache')
+# index the trigrams of the files for search in files
+trigram_index = config.get("trigram_index", False)
+# index the definitions in the files of the directory, for right-click
+symbol_index = config.get("symbol_index", False)
+# files not read by search in files
+walker.set_exclude(config.get("search_exclude", []))
+filesearch.max_size = config.get("search_max_size", filesearch.max_size)
+
+# lex large documents in worker processes
+workers.set_pool(config.get("highlight_processes", 2),
+    config.get("highlight_process_size", 1000000))
 
 root = Tk() # needed here for font definitions
 root.title("TedPy")
@@ -60,92 +95,28 @@ wheel_delta = None
 docs = []
 
 # syntax highlighting parameters
-square_brackets = r'[\[\]]'
-curly_braces = r'[\{\}]'
-parenthesis = r'[\(\)]'
+highlight_tags = ('comment', 'string', 'keyword', 'builtin', 'parenthesis',
+    'curly_brace', 'square_bracket', 'too_long')
+# tags managed by the renderer of each editor
+rendered_tags = highlight_tags + ('kw_start', 'script_in_html')
 
 # supported languages
 langs = {}
-patterns = {}
-zones = {}
+lexers = {}
 ext2lang = {}
+# language of the <script> types in HTML documents
+script_langs = {}
 
 for lang in os.listdir(os.path.join(this_dir, "languages")):
     if lang.endswith(".py") and lang != "__init__.py":
         name = lang.split('.')[0]
         langs[name] = importlib.import_module(f"languages.{name}")
-        patterns[name] = [(square_brackets, 'square_bracket'),
-            (parenthesis, 'parenthesis'), (curly_braces, 'curly_brace')]
-        keywords = [(r'\b' + kw + r'\b') for kw in langs[name].keywords]
-        patterns[name].append(('|'.join(keywords), 'keyword'))
-        builtins_pattern = '|'.join([r'\b{}\b'.format(b)
-            for b in langs[name].builtins])
-        patterns[name].append((builtins_pattern, 'builtin'))
-
-        zones[name] = langs[name].zones
+        lexers[name] = lexer.Lexer(langs[name])
 
         for ext in langs[name].extensions:
             ext2lang[ext] = name
-
-# html parser
-class HTMLParser(html.parser.HTMLParser):
-
-    def __init__(self, editor):
-        html.parser.HTMLParser.__init__(self)
-        self.zone = editor.zone
-        self.scripts = []
-
-    def handle_decl(self, decl):
-        self.handle_endtag(decl)
-
-    def handle_starttag(self, tag, attrs):
-        self.state = None
-        text = self.get_starttag_text()
-        lines = text.split('\n')
-        x0, y0 = self.getpos()
-        if tag.lower() == "script":
-            has_src = False
-            self.state = ".js"
-            for key, value in attrs:
-                if key == "type":
-                    for lang in langs:
-                        if value in langs[lang].script_types:
-                            begin = "{}.{}".format(x0, y0 + len(text))
-                            self.state = lang
-                            break
-                    else:
-                        if value != "text/javascript":
-                            self.state = value
-                elif key == "src":
-                    has_src = True
-            if not has_src:
-                self.begin = "{}.{}".format(x0, y0 + len(text))
-            else:
-                self.state = None
-        x1 = x0 + len(lines) - 1
-        if len(lines) == 1:
-            y1 = y0 + len(text)
-        else:
-            y1 = len(lines[-1])
-        self.zone.tag_add('keyword', '{}.{}'.format(x0, y0),
-            '{}.{}'.format(x0, y0 + 1 + len(tag)))
-        self.zone.tag_add('kw_start', '{}.{}'.format(x0, y0),
-            '{}.{}'.format(x0, y0 + 1 + len(tag)))
-        self.zone.tag_add('comment',
-            '{}.{}'.format(x0, y0 + 1 + len(tag)),
-            '{}.{}'.format(x1, y1))
-        self.zone.tag_add('keyword', '{}.{}'.format(x1, y1) + '-1c',
-            '{}.{}'.format(x1, y1))
-
-    def handle_endtag(self, tag):
-        x, y = self.getpos()
-        p0 = '{}.{}'.format(x, y)
-        if tag == "script" and self.state in patterns:
-            self.scripts.append([self.state,
-                self.zone.index(self.begin + "+1c"), p0])
-        closing_pos = self.zone.search('>', p0)
-        self.zone.tag_add('keyword', p0, closing_pos + '+1c')
-
+        for script_type in langs[name].script_types:
+            script_langs[script_type] = name
 
 class EncodingError(Exception):
     pass
@@ -153,7 +124,7 @@ class EncodingError(Exception):
 
 class Document:
 
-    def __init__(self, file_name, ext=None, text=""):
+    def __init__(self, file_name, ext=None):
         self.has_name = file_name is not None
         if file_name is None:
             # find the first available name "moduleXXX.ext"
@@ -165,7 +136,6 @@ class Document:
                     break
                 num += 1
         self.file_name = os.path.normpath(file_name)
-        self.text = text
         self.ext = ext or os.path.splitext(file_name)[1][1:]
 
 
@@ -251,11 +221,8 @@ class Editor(Frame):
         hbar['command'] = zone.xview
         zone['xscrollcommand'] = hbar.set
 
-        line_nums = Text(frame, width=3, background=bg, font=font,
-            selectbackground='#fff', foreground='#808080',
-            highlightthickness=0, relief=FLAT, state=DISABLED)
-        line_nums.bind('<B1-Motion>', lambda ev: 'break')
-        line_nums.pack(side=LEFT, fill=BOTH)
+        line_nums = gutter.Gutter(frame, zone, font, bg, '#808080')
+        line_nums.canvas.pack(side=LEFT, fill=BOTH)
 
         zone.bind('<Key>', self.key_pressed)
         zone.bind('<KeyRelease>', self.update)
@@ -273,12 +240,12 @@ class Editor(Frame):
         zone.bind('<Configure>', self.configure)
         zone.bind('<Home>', self.home)
 
-        for tag in ('comment', 'string', 'keyword', 'builtin', 'parenthesis',
-                'curly_brace', 'square_bracket', 'too_long'):
+        for tag in highlight_tags:
             zone.tag_config(tag, foreground=colors[tag])
 
         zone.tag_config('script_in_html', borderwidth=2, relief=GROOVE,
             lmargin1=15)
+        zone.tag_config('match', borderwidth=1, relief=SOLID)
         zone.tag_config('found', foreground=bg, background=fg)
         zone.tag_config('selection', background=zone['selectbackground'],
             borderwidth=0)
@@ -290,13 +257,55 @@ class Editor(Frame):
         zone.pack(expand=YES, fill=BOTH)
 
         self.zone = zone
-        self.scripts = []
+        # <script> regions of an HTML document
+        self.script_index = scriptindex.ScriptIndex()
         self.frame = frame
         self.line_nums = line_nums
         self.shift = False
         self.control = False
         self.last_update = None
         self.last_highlight_time = 0.5
+        # lexer state at the start of each line, see highlight_changes()
+        self.line_states = None
+        self.highlighted_lang = None
+        # range of lines modified since the last highlighting
+        self.dirty = None
+        # lines highlighted by highlight_visible()
+        self.guessed = None
+        # number of edits since the editor was created
+        self.revision = 0
+        # revision and hash of the text when the document was opened or
+        # saved, and True if an undo or redo was done since is_modified()
+        self.saved_revision = 0
+        self.saved_hash = hash('')
+        self.undone = False
+        # lines edited since the trailing whitespace was removed
+        self.trailing_lines = set()
+        # tokens of the document computed by a worker process, not rendered
+        # yet
+        self.computed = None
+        # futures of the worker processes, callback, revision when submitted,
+        # edits made since if they are tracked
+        self.worker_jobs = None
+        # tokens of the lines already lexed, to highlight them again without
+        # lexing (undo, redo...) : (language, lexer state at the start of
+        # the line, line text) -> (tokens, lexer state at the end)
+        self.line_cache = {}
+        # for HTML documents : text -> (scripts, tokens of each line), and
+        # revision of the last rendering
+        self.html_cache = {}
+        self.html_revision = None
+        self.intercept_edits()
+        # runs the jobs deferred after key strokes
+        self.scheduler = scheduler.Scheduler(zone)
+        # applies the syntax highlighting tags
+        self.renderer = renderer.Renderer(
+            lambda *args: zone.tk.call(self.tk_command, *args),
+            rendered_tags)
+        # brackets of each line, for brace matching
+        self.brackets = brackets.BracketIndex()
+        # functions, classes and methods, for the structure browser
+        self.outline = outline.Outline()
 
     def button_release(self, event):
         self.zone['cursor'] = 'xterm'
@@ -304,13 +313,15 @@ class Editor(Frame):
 
     def change_encoding(self):
         new_enc = self.encoding.get()
-        # Check that the document can be encoded in the new encoding
+        # Check that the document can be encoded in the new encoding ; the
+        # text inserted afterwards is checked by dispatch()
         src = self.zone.get(1.0, END)
         try:
             src.encode(new_enc)
         except:
             tkinter.messagebox.showinfo(title=_('Encoding error'),
-                message=_('not encoding').format(self.prev_enc))
+                message=_('cannot_encode').format(new_enc))
+            self.encoding.set(self.prev_enc)
 
     def change_size(self, ev):
         """Called when clicking on button ↑ or ↓"""
@@ -340,6 +351,7 @@ class Editor(Frame):
         global close_menu
         self.zone.tag_remove('selection', 1.0, END)
         self.zone.tag_remove('found', 1.0, END)
+        self.zone.tag_remove('match', 1.0, END)
         self.mark_brace(CURRENT)
         # if there is a menu with all functions and classes, unpost it
         self.remove_functions_browser()
@@ -348,12 +360,62 @@ class Editor(Frame):
             close_menu = None
 
     def configure(self, event):
-        self.zone.after(500, self.print_line_nums)
+        self.scheduler.schedule('line_nums', self.print_line_nums, 500)
 
-    def delayed_sh(self):
-        # delayed syntax highlighting, launched by a timer
-        if docs and self.do_delayed:
-            self.syntax_highlight()
+    def dispatch(self, operation, *args):
+        """Called by the procedure that replaces the Tcl command of the text
+        widget (see intercept_edits). Return the Tcl return code and the
+        result of self.run_command()."""
+        try:
+            return 0, self.run_command(operation, *args)
+        except TclError as exc:
+            # the procedure raises the error in Tcl, where the bindings of
+            # the widget can catch it (an exception raised in a Python
+            # callback would stop the main loop)
+            return 1, str(exc)
+
+    def edited(self, start, old_end, new_end):
+        """Called after an edit that replaced the text between positions
+        start and old_end by the text between start and new_end (positions
+        are [line, column] lists)."""
+        first, old_last, new_last = start[0], old_end[0], new_end[0]
+        delta = new_last - old_last
+        self.guessed = None
+        self.revision += 1
+        if self.computed is not None:
+            self.computed.edited(first, old_last, new_last)
+        if self.worker_jobs is not None and self.worker_jobs[3] is not None:
+            # applied to the result of the worker when it is received
+            self.worker_jobs[3].append((first, old_last, new_last))
+        self.renderer.edited(first, old_last, new_last)
+        self.brackets.edited(first, old_last, new_last)
+        self.line_nums.edited(first, old_last, new_last)
+        self.outline.edited(first, old_last, new_last)
+        self.scheduler.schedule('outline', self.update_outline, 1000)
+        if delta:
+            self.trailing_lines = {line if line < first else line + delta
+                for line in self.trailing_lines
+                if line < first or line > old_last}
+        self.trailing_lines.update(range(first, new_last + 1))
+        if self.line_states is not None:
+            # the lexer states of the lines after the first one in the
+            # edited range are unknown
+            self.line_states[first:old_last] = [-1] * (new_last - first)
+        if self.dirty is None:
+            self.dirty = [first, new_last]
+        else:
+            low, high = self.dirty
+            if low > old_last:
+                low += delta
+            if high > old_last:
+                high += delta
+            elif high >= first:
+                high = new_last
+            self.dirty = [min(low, first), max(high, new_last)]
+
+    def encoding_error(self):
+        tkinter.messagebox.showerror(title=_('unicode error'),
+            message=_('cannot_encode').format(self.encoding.get()))
 
     def get_extension(self):
         return os.path.splitext(docs[current_doc].file_name)[1]
@@ -362,11 +424,12 @@ class Editor(Frame):
         ext = self.get_extension()
         pos = self.zone.index(pos)
         if ext == '.html':
-            self.html_highlight() # reset self.scripts
-            if "script_in_html" in self.zone.tag_names(pos):
-                for (lang, begin, end) in self.scripts:
-                    if float(begin) <= float(pos) <= float(end):
-                        return lang, begin, end
+            if not self.script_index.valid:
+                self.html_highlight()
+            script = self.script_index.find(tuple(self.ix2pos(pos)))
+            if script is not None:
+                lang, begin, end = script
+                return lang, '{}.{}'.format(*begin), '{}.{}'.format(*end)
         lang = ext2lang.get(ext)
         return lang, "1.0", END
 
@@ -384,77 +447,190 @@ class Editor(Frame):
     def goto(self, evt):
         browser_line = int(evt.widget.index(CURRENT).split('.')[0])
         line_num = self.function_line_nums[browser_line - 1]
+        if isinstance(line_num, tuple):
+            # definition in another file
+            self.remove_functions_browser()
+            goto_file(*line_num)
+            return
         self.browser.destroy()
         self.zone.focus()
         self.zone.mark_set(INSERT, '{}.0'.format(line_num))
         self.zone.see(INSERT)
         self.print_line_nums()
 
-    def highlight_lang(self, begin, end, lang, in_html=False):
-        txt = self.zone.get(begin, end).rstrip() + '\n'
-        ltxt = list(txt)
-        # mapping between position and line,column
-        lc = []
-        line, col = self.ix2pos(begin)
-        for car in txt:
-            lc.append((line, col))
-            col += 1
-            if car == '\n':
-                line += 1
-                col = 0
-        # remove existing tags
-        for tag in self.zone.tag_names():
-            self.zone.tag_remove(tag, begin, end)
-        # parse text to find strings, comments, keywords
-        pos = 0
-        zones[lang].sort(key=lambda x: len(x[0]), reverse=True)
-        t1 = time.time()
-        nb0 = 0
-        while pos < len(txt):
-            flag = False
-            for start, stop, ztype in zones[lang]:
-                if txt[pos:pos + len(start)] == start:
-                    spos = pos + len(start)
-                    s_end = -1
-                    nb_escape = 0
-                    while spos < len(txt):
-                        if txt[spos:spos + len(stop)] == stop and nb_escape % 2 == 0:
-                            s_end = spos
-                            spos = s_end + 1
-                            break
-                        elif txt[spos] == '\\':
-                            nb_escape += 1
-                        else:
-                            nb_escape = 0
-                        spos += 1
-                    if s_end > -1:
-                        # set zone to whitespace for next markup
-                        for i in range(pos, s_end + len(stop)):
-                            ltxt[i] = ' '
-                        # highlight zone with matching tag
-                        ix1 = '{}.{}'.format(*lc[pos])
-                        ix2 = '{}.{}'.format(*lc[min(s_end + len(stop),
-                            len(txt) - 1)])
-                        self.zone.tag_add(ztype, ix1, ix2)
-                        nb0 += 1
-                        pos = s_end + len(stop)
-                        flag = True
-                    break # if """ matched, don't try a single "
-            if not flag:
-                pos += 1
-        raw = ''.join(ltxt) # original text with empty strings and comments
-        for (pattern, tag) in patterns[lang]:
-            for mo in re.finditer(pattern, raw, re.S):
-                k1, k2 = mo.start(), mo.end()
-                self.zone.tag_add(tag,'{}.{}'.format(*lc[k1]),
-                    '{}.{}'.format(*lc[k2]))
-        # hightlight the part that exceeds 80 characters
-        for linenum in range(self.ix2pos(begin)[0], self.ix2pos(end)[0]):
-            lineend = self.ix2pos('{}.0'.format(linenum) + 'lineend')[1]
-            if lineend > 78:
-                self.zone.tag_add('too_long', '{}.{}'.format(linenum, 78),
-                    '{}.{}'.format(linenum, lineend))
+    def highlight_changes(self, lang):
+        """Highlight the lines modified since the last highlighting, then the
+        next lines until the lexer state at the start of a line is the same
+        as before the modification.
+        Highlighting stops after highlight_slice seconds : the visible lines
+        are highlighted, and a timer is set to highlight the rest later."""
+        t0 = time.time()
+        nb_lines = self.nb_lines()
+        if self.line_states is None or self.highlighted_lang != lang:
+            # highlight the whole document
+            self.line_states = [None] * nb_lines
+            self.highlighted_lang = lang
+            self.dirty = [1, nb_lines]
+            self.computed = None
+            if workers.max_workers:
+                txt = self.zone.get('1.0', END)
+                if workers.enabled(len(txt)):
+                    self.wait_workers([workers.submit_lines(lang, txt)],
+                        self.set_computed, track_edits=True)
+        if self.dirty is None:
+            return
+        if self.scheduler.pending('workers'):
+            # the document is lexed by a worker process
+            self.highlight_visible()
+            return
+        first, last = self.dirty
+        self.dirty = None
+        line, nb = first, min(last - first + 1, 100)
+        while line <= nb_lines:
+            if time.time() - t0 > highlight_slice:
+                self.dirty = [line, max(line, last)]
+                self.highlight_visible()
+                if not self.scheduler.pending('highlight_pending'):
+                    self.scheduler.schedule('highlight_pending',
+                        self.highlight_pending, 10)
+                return
+            chunk_end = min(line + nb - 1, nb_lines)
+            computed = self.computed
+            if computed is not None:
+                known, chunk_end = computed.run(line, chunk_end)
+                if not known:
+                    # lines edited since the document was lexed
+                    computed = None
+                elif computed.state(line) != self.line_states[line - 1]:
+                    # the edits changed the lexer state of the next lines
+                    self.computed = computed = None
+            if computed is not None:
+                # the document was lexed by a worker process
+                tokens, states = computed.lines(line, chunk_end)
+                self.renderer.render(line, tokens)
+                self.brackets.set_lines(line, self.zone.get(
+                    '{}.0'.format(line), '{}.0'.format(chunk_end + 1)
+                    ).split('\n'), tokens)
+            else:
+                states = self.highlight_lang('{}.0'.format(line),
+                    '{}.0'.format(chunk_end + 1), lang,
+                    state=self.line_states[line - 1])
+            # states[i] is the lexer state at the start of line line + i + 1
+            for num, state in enumerate(states, start=line + 1):
+                if num > nb_lines:
+                    break
+                previous = self.line_states[num - 1]
+                self.line_states[num - 1] = state
+                if num > last and state == previous:
+                    # the next lines are highlighted as before
+                    self.computed = None
+                    return
+            line = chunk_end + 1
+            nb = min(2 * nb, 1000)
+        self.computed = None
+
+    def highlight_lang(self, begin, end, lang, state=None):
+        """Highlight the lines between begin and end in language lang. The
+        text starts in lexer state state (see lexer.Lexer.tokenize).
+        Return the lexer states at the start of the lines after the first
+        one."""
+        txt = self.zone.get(begin, end)
+        if not txt.endswith('\n'):
+            txt += '\n'
+        texts = txt.split('\n')[:-1]
+        # lines found in the cache
+        tokens, line_states = [], []
+        for text in texts:
+            cached = self.line_cache.get((lang, state, text))
+            if cached is None:
+                break
+            tokens.append(cached[0])
+            line_states.append(cached[1])
+            state = cached[1]
+        line = self.ix2pos(begin)[0]
+        if len(tokens) < len(texts):
+            # lex the next lines
+            txt = txt[sum(len(text) + 1 for text in texts[:len(tokens)]):]
+            spans, states = lexers[lang].tokenize(txt, state)
+            lines = lineindex.LineIndex(txt, line + len(tokens))
+            lexed = renderer.split_lines(spans, lines)[:-1]
+            renderer.mark_too_long(lexed, lines)
+            if len(self.line_cache) > line_cache_size:
+                self.line_cache.clear()
+            for text, line_tokens, next_state in zip(texts[len(tokens):],
+                    lexed, states):
+                self.line_cache[(lang, state, text)] = (line_tokens,
+                    next_state)
+                state = next_state
+            tokens += lexed
+            line_states += states
+        self.renderer.render(line, tokens)
+        self.brackets.set_lines(line, texts, tokens)
         self.last_update = time.time()
+        return line_states
+
+    def highlight_pending(self):
+        """Timer callback : go on highlighting the lines that are not
+        highlighted yet."""
+        if self.line_states is not None:
+            self.highlight_changes(self.highlighted_lang)
+
+    def highlight_script(self):
+        """If the lines modified since the last highlighting of the HTML
+        document are inside a script, highlight again the lines of this
+        script and return True. Return False if the whole document must be
+        lexed again."""
+        if not self.script_index.valid or self.dirty is None:
+            return False
+        first, last = self.dirty
+        found = self.script_index.find((first, 0))
+        if found is None:
+            return False
+        lang, begin, end = found
+        # first line with only script text
+        start = begin[0] if begin[1] == 0 else begin[0] + 1
+        if not (start <= first and last < end[0]) or lang not in lexers:
+            return False
+        if self.zone.get('{}.0'.format(end[0]),
+                '{}.{}'.format(*end)).strip():
+            # the last line of the script is also the line of </script>
+            return False
+        txt = self.zone.get('{}.{}'.format(*begin), '{}.{}'.format(*end))
+        spans, states = lexers[lang].tokenize(txt)
+        if states[-1] is not None:
+            # a string or a comment goes on up to </script>
+            return False
+        lines = lineindex.LineIndex(txt, *begin)
+        # tokens of the lines start to the line before </script>
+        tokens = renderer.split_lines(spans, lines)
+        renderer.mark_too_long(tokens, lines, start - begin[0],
+            len(tokens) - 1)
+        tokens = [line_tokens + [(0, None, 'script_in_html')]
+            for line_tokens in tokens[start - begin[0]:-1]]
+        self.renderer.render(start, tokens)
+        self.dirty = None
+        self.html_revision = self.revision
+        return True
+
+    def highlight_visible(self):
+        """If some visible lines are not highlighted yet, highlight them
+        using the lexer state of their first line before the last edits.
+        They will be highlighted again by highlight_changes(), with the
+        right lexer state."""
+        if self.line_states is None or self.dirty is None:
+            return
+        start, end = self.get_visible_text()
+        # the widget may not be displayed yet
+        end = max(end, start + int(self.zone['height'])) + highlight_margin
+        start = max(start, self.dirty[0])
+        end = min(end, len(self.line_states))
+        if start > end or (self.guessed is not None and
+                self.guessed[0] <= start and end <= self.guessed[1]):
+            return
+        state = self.line_states[start - 1]
+        self.highlight_lang('{}.0'.format(start), '{}.0'.format(end + 1),
+            self.highlighted_lang, state=None if state == -1 else state)
+        self.guessed = (start, end)
 
     def home(self,event):
         """Home key : go to start of line, after the indentation"""
@@ -467,15 +643,18 @@ class Editor(Frame):
              self.zone.index(INSERT), nbspaces))
         return 'break'
 
-    def html_highlight(self):
-        txt = self.zone.get(1.0, END).rstrip() + '\n'
-        parser = HTMLParser(self)
-        # while editing there may be parser error, ignore them
-        try:
-            parser.feed(txt)
-            self.scripts = parser.scripts
-        except Exception as exc:
-            pass
+    def html_highlight(self, txt=None):
+        """Lex the HTML document and set self.script_index. Return the line
+        index of the text, the spans of the HTML syntax and the scripts
+        (lang, tag start, begin, end), as offsets in the text."""
+        if txt is None:
+            txt = self.zone.get(1.0, END).rstrip() + '\n'
+        spans, scripts = htmllexer.tokenize(txt, script_langs)
+        lines = lineindex.LineIndex(txt)
+        pos = lines.pos
+        self.script_index.set([(pos(begin), pos(end), lang, pos(tag_start))
+            for (lang, tag_start, begin, end) in scripts])
+        return lines, spans, scripts
 
     def insert_cr(self,event):
         """Handle Enter key"""
@@ -526,6 +705,34 @@ class Editor(Frame):
                 self.zone.insert(float(line), ' ' * self.spaces_per_tab.get())
         return 'break'
 
+    def intercept_edits(self):
+        """Replace the Tcl command of the text widget by a procedure that
+        calls self.dispatch, to know all the insertions and deletions,
+        including those made by the default key bindings and by undo /
+        redo."""
+        zone = self.zone
+        self.tk_command = zone._w + '_orig'
+        zone.tk.call('rename', zone._w, self.tk_command)
+        zone.tk.createcommand(zone._w + '_dispatch', self.dispatch)
+        # the Tcl errors of the original command are returned by dispatch
+        # and raised by the procedure
+        zone.tk.call('proc', zone._w, 'args',
+            'lassign [{}_dispatch {{*}}$args] code result\n'
+            'return -code $code $result'.format(zone._w))
+
+    def is_modified(self):
+        """Return True if the document was modified since it was opened or
+        saved."""
+        if self.revision == self.saved_revision:
+            return False
+        if self.undone:
+            # the text may be the same as when it was saved
+            self.undone = False
+            if hash(self.zone.get(1.0, END + '-1c')) == self.saved_hash:
+                self.saved_revision = self.revision
+                return False
+        return True
+
     def ix2pos(self, ix):
         return [int(x) for x in self.zone.index(ix).split('.')]
 
@@ -544,94 +751,83 @@ class Editor(Frame):
                 self.delete_end = True
 
     def mark_brace(self, pos):
+        """Highlight the bracket at pos and the matching bracket, and
+        underline the brackets that have no match."""
         if not syntax_highlight.get():
             return
 
         ext = self.get_extension()
         if not ext in ['.py', '.js']:
             return
+        if self.dirty is not None or not self.brackets.complete():
+            # wait until the document is highlighted
+            self.scheduler.schedule('brace', lambda: self.mark_brace(pos),
+                100)
+            return
         self.zone.tag_remove('matching_brace', '1.0', END)
-
-        for p in pos + '-1c', pos, pos + '+1c':
-            px = self.zone.index(p)
-            if 'string' in self.zone.tag_names(px):
-                return
-            car = self.zone.get(px)
-            if car in '([{':
-                # opening brace : look for closing (after)
-                match, start, nb = ')]}'['([{'.index(car)], px, 1
-                incr, backwards, end_pos = "+1c", False, END
+        if self.brackets.update():
+            self.zone.tag_remove('lone_brace', '1.0', END)
+            indices = []
+            for line, col in self.brackets.lone_lines():
+                indices += ['{}.{}'.format(line, col),
+                    '{}.{}'.format(line, col + 1)]
+            if indices:
+                self.zone.tag_add('lone_brace', *indices)
+
+        line, pos_col = self.ix2pos(pos)
+        brackets = dict(self.brackets.lines[line - 1] or [])
+        for col in pos_col - 1, pos_col, pos_col + 1:
+            car = brackets.get(col)
+            if car is None:
+                continue
+            elif car in '([{' or col == pos_col:
                 break
-            elif p in [pos, pos + "-1c"] and car in '}])':
-                if p == pos + "-1c" and self.zone.get(pos) in '([{}])':
-                    continue
-                # closing brace : look for opening (before)
-                match, start, nb = '([{'[')]}'.index(car)], px, 1
-                incr, backwards, end_pos = "-1c", True, '1.0'
+            elif col == pos_col - 1 and pos_col not in brackets:
+                # closing brace before pos
                 break
         else:
             return
+        match = self.brackets.match(line, col)
+        if match is not None:
+            self.zone.tag_add('matching_brace', '{}.{}'.format(line, col),
+                '{}.{}'.format(line, col + 1), '{}.{}'.format(*match),
+                '{}.{}'.format(match[0], match[1] + 1))
 
-        pattern = '[\\' + car + '\\' + match + ']'
-        p = start
-        while True:
-            next_pos = self.zone.index(p + incr)
-            if backwards and re.match(pattern, self.zone.get(next_pos)):
-                p = next_pos
-            else:
-                p = self.zone.search(pattern, next_pos, end_pos,
-                    regexp=True, backwards=backwards)
-            if not p:
-                break
-            elif 'string' in self.zone.tag_names(p):
-                continue
-            else:
-                c = self.zone.get(p)
-                if c == car:
-                    nb += 1
-                elif c == match:
-                    nb -= 1
-                    if nb == 0:
-                        self.zone.tag_add('matching_brace', start)
-                        self.zone.tag_add('matching_brace', p)
-                        return
+    def nb_lines(self):
+        return int(self.zone.index('{}-1c'.format(END)).split('.')[0])
 
     def paste(self, event):
         self.syntax_highlight()
         self.print_line_nums()
         return 'break'
 
+    def poll_workers(self):
+        """Timer callback : if the worker processes have finished, call the
+        callback set by wait_workers()."""
+        futures, callback, revision, edits = self.worker_jobs
+        if not all(future.done() for future in futures):
+            self.scheduler.schedule('workers', self.poll_workers, 20)
+            return
+        self.worker_jobs = None
+        if any(future.cancelled() for future in futures):
+            # the pool was shut down (see workers.reset) : highlight again
+            pass
+        elif any(future.exception() for future in futures):
+            # lex in the main thread from now on
+            workers.set_pool(0, 0)
+        elif revision == self.revision or edits is not None:
+            for future in futures:
+                for edit in edits or []:
+                    future.result().edited(*edit)
+            callback(futures)
+            return
+        # the document was edited in the meantime, or the result is not
+        # available : highlight it again
+        self.line_states = None
+        self.scheduler.schedule('highlight', self.syntax_highlight)
+
     def print_line_nums(self, *args):
-        start, end = self.get_visible_text()
-        line_nums = []
-        bbox = None
-        for first_visible in range(start, end + 1):
-            bbox = self.zone.bbox(f'{first_visible}.0linestart')
-            if bbox is not None:
-                break
-            else:
-                bbox_end = self.zone.bbox(f'{first_visible}.0lineend')
-                if bbox_end is not None:
-                    nb_visible_lines = round(0.5 +
-                        bbox_end[1] / bbox_end[3])
-                    line_nums += [' '] * nb_visible_lines
-        y_offset = bbox[1] if bbox is not None else 0
-        nb_lines = int(self.zone.index('{}-1c'.format(END)).split('.')[0])
-        nb_chars = len(str(nb_lines))
-        for i in range(first_visible, end + 1):
-            line_nums.append(str(i).rjust(nb_chars))
-            nb_physical_lines = self.zone.count(f'{i}.0', f'{i + 1}.0',
-                'displaylines')
-            if nb_physical_lines and nb_physical_lines[0] > 1:
-                line_nums += [' '] * (nb_physical_lines[0] - 1)
-        if y_offset < 0:
-            line_nums.append(' ' * nb_chars)
-        self.line_nums.config(state=NORMAL)
-        self.line_nums['width'] = 2 + len(str(nb_lines + 1))
-        self.line_nums.delete(1.0, END)
-        self.line_nums.insert(1.0, '\n'.join(line_nums))
-        self.line_nums.yview('scroll', -y_offset, 'pixels')
-        self.line_nums.config(state=DISABLED)
+        self.line_nums.draw()
 
     def redo(self,*args):
         try:
@@ -669,15 +865,48 @@ class Editor(Frame):
         return 'break'
 
     def remove_trailing_whitespace(self):
-        """Removes trailing whitespaces."""
-        last_line = self.ix2pos(END)[0]
-        for i in range(1, last_line + 1):
-            line = self.zone.get('{}.0linestart'.format(i),
-                '{}.0lineend'.format(i))
-            rstripped = line.rstrip()
-            if rstripped != line:
-                self.zone.delete('{}.{}'.format(i, len(rstripped)),
-                    '{}.0lineend'.format(i))
+        """Removes trailing whitespaces in the lines edited since the last
+        call."""
+        lines = sorted(self.trailing_lines)
+        # ranges of consecutive lines
+        ranges = []
+        for line in lines:
+            if ranges and ranges[-1][1] == line - 1:
+                ranges[-1][1] = line
+            else:
+                ranges.append([line, line])
+        for first, last in ranges:
+            txt = self.zone.get('{}.0'.format(first),
+                '{}.0lineend'.format(last))
+            for num, line in enumerate(txt.split('\n'), start=first):
+                rstripped = line.rstrip()
+                if rstripped != line:
+                    self.zone.delete('{}.{}'.format(num, len(rstripped)),
+                        '{}.{}'.format(num, len(line)))
+        self.trailing_lines = set()
+
+    def render_html(self, txt, lines, spans, scripts, script_spans):
+        """Render the spans of the HTML document txt (lines is its line
+        index), and the spans of the scripts (lang, start, stop)."""
+        for (lang, start, stop), found in zip(scripts, script_spans):
+            spans += [(k1 + start, k2 + start, tag) for (k1, k2, tag) in found]
+            spans.append((start, stop, 'script_in_html'))
+        tokens = renderer.split_lines(spans, lines)[:-1]
+        # hightlight the part of script lines that exceeds 80 characters
+        for (lang, start, stop) in scripts:
+            renderer.mark_too_long(tokens, lines, lines.line_num(start),
+                lines.line_num(stop))
+        if len(self.html_cache) >= html_cache_size:
+            del self.html_cache[next(iter(self.html_cache))]
+        self.html_cache[txt] = (self.script_index.regions, tokens)
+        self.render_html_tokens(tokens)
+
+    def render_html_tokens(self, tokens):
+        # the lines removed by rstrip() have no tokens
+        tokens = tokens + [[]] * (self.nb_lines() - len(tokens))
+        self.renderer.render(1, tokens)
+        self.dirty = None
+        self.html_revision = self.revision
 
     def right_click(self, event):
         self.remove_functions_browser()
@@ -695,12 +924,8 @@ class Editor(Frame):
         targets = []
         if current == self.zone.index(current + 'lineend'):
             # menu to reach all functions, classes and methods in the script
-            lines = [x.rstrip() for x in self.zone.get(begin, end).split('\n')]
-            for i, line in enumerate(lines):
-                for pattern in struct_patterns:
-                    if re.search(pattern, line):
-                        label, num = line[:line.find('(')], i + first_line
-                        targets.append((label, num))
+            self.update_outline()
+            targets = self.outline.targets(first_line, self.ix2pos(end)[0])
         else:
             self.zone.tag_remove('word', begin, end)
             # right-click on indentation : ignore
@@ -737,6 +962,15 @@ class Editor(Frame):
                     if not targets or targets[-1][1] != num:
                         targets.append((label, num))
                 pos = end_pos
+            if symbol_index and docs[current_doc].has_name:
+                # definitions in the other files of the directory
+                index = symbols.get(default_dir(), cache_dir)
+                index.start_update(symbol_languages())
+                for path, num, label in index.lookup(word):
+                    if path != docs[current_doc].file_name:
+                        targets.append(('{}:{}: {}'.format(
+                            os.path.relpath(path, index.root), num, label),
+                            (path, num)))
 
         if targets:
             self.function_line_nums = []
@@ -753,12 +987,92 @@ class Editor(Frame):
                 text = ScrolledText(self.browser, height=40, wrap=NONE)
             text.config(bg=colors['right_click_menu'], cursor="arrow", fg=fg,
                 font=font, padx=5, width=int(self.text_width() * 0.4))
-            for label, num in targets:
-                text.insert(END, "{}: {}\n".format(num, label))
-                self.function_line_nums.append(num)
+            # the definitions in other files have their location in the
+            # label
+            text.insert(END, ''.join("{}\n".format(label)
+                if isinstance(num, tuple) else "{}: {}\n".format(num, label)
+                for label, num in targets))
+            self.function_line_nums = [num for label, num in targets]
             text.pack(fill=BOTH, expand=True)
             text.bind('<Button-1>', self.goto)
 
+    def run_command(self, operation, *args):
+        """Run the original Tcl command of the text widget and, for
+        insertions and deletions, call self.edited() with the modified
+        range."""
+        call = self.zone.tk.call
+        command = self.tk_command
+        edit = None
+        if operation == 'edit' and args and args[0] in ('undo', 'redo'):
+            self.undone = True
+        if operation in ('insert', 'delete', 'replace') and args:
+            last = call(command, 'index', 'end-1c')
+            start = call(command, 'index', args[0])
+            if call(command, 'compare', start, '>', last):
+                start = last
+            if operation == 'insert':
+                old_end = start
+                chars = ''.join(args[1::2])
+            elif operation == 'replace' or len(args) == 2:
+                old_end = call(command, 'index', args[1])
+                chars = ''.join(args[2::2])
+            elif len(args) == 1:
+                old_end = call(command, 'index', args[0] + '+1c')
+                chars = ''
+            else:
+                # several ranges : consider that all the end is modified
+                old_end = last
+                chars = None
+            if call(command, 'compare', old_end, '>', last):
+                old_end = last
+            if call(command, 'compare', old_end, '<', start):
+                old_end = start
+            edit = (start, old_end, chars)
+            if chars and not chars.isascii():
+                # refuse the characters that can't be encoded in the
+                # encoding of the document
+                encoding = self.encoding.get()
+                try:
+                    chars.encode(encoding or 'utf-8')
+                except UnicodeError:
+                    self.scheduler.schedule('encoding', self.encoding_error)
+                    return ''
+            if self.script_index.valid:
+                # text around the edit, to know if the <script> regions of
+                # an HTML document may change
+                if chars is None:
+                    self.script_index.valid = False
+                else:
+                    changed = call(command, 'get', '{}-1c'.format(start),
+                        old_end) + chars
+                    lines = call(command, 'get', '{} linestart'.format(start),
+                        '{} lineend'.format(old_end))
+        result = call((command, operation) + args)
+        if edit is not None:
+            start, old_end, chars = edit
+            start = [int(x) for x in str(start).split('.')]
+            old_end = [int(x) for x in str(old_end).split('.')]
+            if chars is None:
+                new_end = [int(x) for x in
+                    str(call(command, 'index', 'end-1c')).split('.')]
+            elif '\n' in chars:
+                new_end = [start[0] + chars.count('\n'),
+                    len(chars) - chars.rfind('\n') - 1]
+            else:
+                new_end = [start[0], start[1] + len(chars)]
+            self.edited(start, old_end, new_end)
+            if self.script_index.valid:
+                lines += call(command, 'get', '{}.0'.format(start[0]),
+                    '{}.{} lineend'.format(*new_end))
+                self.script_index.edited(tuple(start), tuple(old_end),
+                    tuple(new_end), changed, lines)
+        return result
+
+    def set_computed(self, futures):
+        """Callback of the worker process that lexed the whole document."""
+        self.computed = futures[0].result()
+        self.highlight_changes(self.highlighted_lang)
+
     def set_control(self,event):
         self.control = True
 
@@ -770,6 +1084,13 @@ class Editor(Frame):
                 command=self.change_encoding)
         menu.post(event.x_root, event.y_root)
 
+    def set_saved(self, txt):
+        """Called when the document is opened or saved, txt is its
+        content."""
+        self.saved_revision = self.revision
+        self.saved_hash = hash(txt)
+        self.undone = False
+
     def set_spaces_per_tab(self, event):
         menu = Menu(self.zone, tearoff=False)
         for value in [2, 4]:
@@ -792,49 +1113,76 @@ class Editor(Frame):
 
     def slide(self, *args):
         self.zone.yview(*args)
+        self.highlight_visible()
         self.print_line_nums()
 
     def syntax_highlight(self):
         t0 = time.time()
-        file_browser.mark_if_changed()
+        self.scheduler.schedule('modified', file_browser.mark_if_changed)
         self.highlight = syntax_highlight.get()
         if not syntax_highlight.get():
             # remove existing tags
             for tag in self.zone.tag_names():
                 self.zone.tag_remove(tag, 1.0, END)
+            self.line_states = None
+            self.html_revision = None
+            self.renderer.clear(self.nb_lines())
+            self.brackets.clear()
             return
-        # check encoding
-        try:
-            self.zone.get(1.0, END).encode(self.encoding.get())
-        except UnicodeError:
-            tkinter.messagebox.showerror(title=_('unicode error'),
-                message=_('cannot_encode').format(self.encoding.get()))
-            self.zone.delete(self.zone.index('{}-1c'.format(INSERT)))
-
         ext = self.get_extension()
         if ext == '.html':
-            for (lang, begin, end) in self.scripts:
-                self.zone.tag_remove('script_in_html', begin, end)
-            self.html_highlight()
+            if self.html_revision == self.revision:
+                # not modified since the last rendering
+                return
+            if self.highlight_script():
+                # only the lines of a script were modified
+                return
+            # don't lex the whole document too often, as for the other
+            # languages
+            if self.last_update and \
+                time.time() - self.last_update < self.last_highlight_time:
+                self.scheduler.schedule('highlight', self.syntax_highlight,
+                    int(1000 * self.last_highlight_time))
+                return
+            t0 = time.time()
+            txt = self.zone.get(1.0, END).rstrip() + '\n'
+            if txt in self.html_cache:
+                # same text as a previous rendering (undo, redo...)
+                regions, tokens = self.html_cache[txt]
+                self.script_index.set(regions)
+                self.render_html_tokens(tokens)
+                return
+            lines, spans, scripts = self.html_highlight(txt)
             # highlight the scripts inside <script> tags
-            for (lang, begin, end) in self.scripts:
-                self.highlight_lang(begin, end, lang, in_html=True)
-                self.zone.tag_add('script_in_html', begin, end)
+            scripts = [(lang, begin, end)
+                for (lang, tag_start, begin, end) in scripts]
+            if scripts and workers.enabled(len(txt)):
+                # lex the scripts in parallel in worker processes
+                futures = [workers.submit_spans(lang, txt[start:stop])
+                    for (lang, start, stop) in scripts]
+                self.wait_workers(futures,
+                    lambda futures: self.render_html(txt, lines, spans,
+                        scripts, [workers.spans(future)[0]
+                            for future in futures]))
+            else:
+                self.render_html(txt, lines, spans, scripts,
+                    [lexers[lang].tokenize(txt[start:stop])[0]
+                        for (lang, start, stop) in scripts])
+            self.last_update = time.time()
+            self.last_highlight_time = self.last_update - t0
             return
         lang = ext2lang.get(ext)
-        if lang is None or not lang in patterns:
+        if lang is None or not lang in lexers:
             return
-        # don't do highlighting too often
+        # don't do highlighting too often : do it later, if nothing was
+        # entered in the meantime
         if self.last_update and \
             time.time() - self.last_update < self.last_highlight_time:
-            self.do_delayed = True
-            # set a timer that will do a syntax highlight later
-            # if nothing was entered in the meantime
-            self.zone.after(int(1000 * self.last_highlight_time),
-                self.delayed_sh)
+            self.scheduler.schedule('highlight', self.syntax_highlight,
+                int(1000 * self.last_highlight_time))
             return
-        self.do_delayed = False
-        self.highlight_lang(1.0, END, lang)
+        self.scheduler.cancel('highlight')
+        self.highlight_changes(lang)
         self.last_update = time.time()
         self.last_highlight_time = self.last_update - t0
 
@@ -867,24 +1215,53 @@ class Editor(Frame):
             if not event.char or \
                     (hasattr(event.char, 'string') and not event.char.string):
                 return
+        # the rest is done when Tk is idle, once for several key strokes
         if not event.keysym in ['Up', 'Down', 'Left', 'Right', 'Next',
                 'Prior', 'Home', 'End', 'Control_L', 'Control_R']:
-            self.syntax_highlight()
-        self.mark_brace(INSERT)
+            self.scheduler.schedule('highlight', self.syntax_highlight)
+        self.scheduler.schedule('brace', lambda: self.mark_brace(INSERT))
         if not event.char:
             if event.keysym in ['Next', 'Prior', 'BackSpace', 'Delete']:
-                self.print_line_nums()
+                self.scheduler.schedule('line_nums', self.print_line_nums)
             if getattr(self, "delete_end", False):
                 # delete at line end : remove next line indentation
                 while self.zone.get(INSERT) == ' ':
                     self.zone.delete(INSERT)
 
+    def update_outline(self):
+        """Find the functions, classes and methods in the lines edited since
+        the last update."""
+        if not docs or docs[current_doc].editor is not self:
+            # the extension is the one of the current document
+            return
+        lang = ext2lang.get(self.get_extension())
+        struct_patterns = getattr(langs.get(lang), "struct_patterns", None)
+        if struct_patterns is None:
+            return
+        self.outline.update(lang, struct_patterns, self.nb_lines(),
+            lambda first, last: self.zone.get('{}.0'.format(first),
+                '{}.0 lineend'.format(last)))
+
     def update_line_col(self, *args):
         self.current_line, column = map(int,
             self.zone.index(INSERT).split('.'))
         self.label_line['text'] = "{: 5d}".format(self.current_line)
         self.label_column['text'] = "{: 3d}".format(column + 1)
 
+    def wait_workers(self, futures, callback, track_edits=False):
+        """Call callback(futures) when the futures submitted to the worker
+        processes are done, unless the document is edited in the meantime.
+        If track_edits is set, the results are workers.LineTokens : the
+        edits made in the meantime are applied to them, and the callback is
+        called anyway. Replaces the previous call, if it is still
+        waiting."""
+        if self.worker_jobs is not None:
+            for future in self.worker_jobs[0]:
+                future.cancel()
+        self.worker_jobs = (futures, callback, self.revision,
+            [] if track_edits else None)
+        self.scheduler.schedule('workers', self.poll_workers, 20)
+
     def wheel(self,event):
         """Mouse wheel for systems where events are Button-4 and Button-5."""
         global wheel_delta
@@ -902,21 +1279,27 @@ class Editor(Frame):
 class Searcher:
     """Class for search dialogs."""
 
+    def __init__(self):
+        # matches of the searched string in the current document
+        self.matches = matches.MatchList()
+
     def editor(self):
         return docs[current_doc].editor
 
     def zone(self):
         return docs[current_doc].editor.zone
 
-    def set_search_boundaries(self):
+    def set_search_boundaries(self, backwards=False):
         selected = self.zone().tag_ranges(SEL)
         if selected: # search in selection
-            self.search_pos, self.search_end = selected
+            self.search_start, self.search_end = selected
+            self.search_pos = selected[1] if backwards else selected[0]
         else: # search in whole document
-            self.search_pos, self.search_end = INSERT, None
+            self.search_start, self.search_end = '1.0', None
+            self.search_pos = INSERT
         found = self.zone().tag_ranges('found')
         if found:
-            self.search_pos = found[1]
+            self.search_pos = found[0] if backwards else found[1]
 
     def search(self, repl=False, files=False):
         selected = self.zone().tag_ranges(SEL)
@@ -924,7 +1307,8 @@ class Searcher:
             self.zone().tag_add('selection', *selected)
         self.top = Toplevel(root)
         root.search = self.top
-        self.top.title(_('search' if not files else 'search in files'))
+        self.top.title(_('replace in files' if repl and files else
+            'search in files' if files else 'search'))
         self.top.transient(root)
         self.top.protocol('WM_DELETE_WINDOW', self.end_search)
         self.searched = Entry(self.top, relief=GROOVE, borderwidth=4)
@@ -939,9 +1323,8 @@ class Searcher:
             variable=full_word).pack(anchor=W)
         Checkbutton(f_buttons, text=_('case insensitive'),
             variable=case_insensitive).pack(anchor=W)
-        if not files:
-            Checkbutton(f_buttons, text=_('regular expression'),
-                variable=regular_expression).pack(anchor=W)
+        Checkbutton(f_buttons, text=_('regular expression'),
+            variable=regular_expression).pack(anchor=W)
         f_buttons.pack(side=LEFT)
         if files:
             ext = Frame(f_buttons)
@@ -950,7 +1333,10 @@ class Searcher:
             self.extensions.insert(INSERT, docs[current_doc].ext)
             self.extensions.pack()
             ext.pack(side=BOTTOM, pady=5)
-        if repl:
+        if repl and files:
+            Button(self.top, text=_('replace in files'),
+                command=self.make_replace_files).pack()
+        elif repl:
             Button(self.top, text=_('replace next'),
                 command=self.make_replace).pack()
             Button(self.top, text=_('replace all'),
@@ -961,192 +1347,400 @@ class Searcher:
         else:
             Button(self.top, text=_('search'),
                 command=self.make_search).pack()
+            Button(self.top, text=_('search previous'),
+                command=self.make_search_previous).pack()
+        if not files:
+            # "n of m" after a match is found
+            self.count = StringVar(self.top)
+            Label(self.top, textvariable=self.count).pack()
         case_insensitive.set(False)
 
     def end_search(self):
         self.zone().tag_remove('selection', 1.0, END)
         self.zone().tag_remove('found', 1.0, END)
+        self.zone().tag_remove('match', 1.0, END)
         self.top.destroy()
 
-    def make_search(self):
-        self.set_search_boundaries()
-        pos = self.find_next()
-        self.zone().tag_remove('found', 1.0, END)
-        if pos:
-            self.zone().tag_add('found', pos,
-                '{}+{}c'.format(pos,found_length.get()))
-            self.search_pos = '{}+{}c'.format(pos, found_length.get())
-            self.zone().see(pos)
+    def make_search(self, backwards=False):
+        self.set_search_boundaries(backwards)
+        try:
+            num = self.find_next(backwards)
+        except re.error as exc:
+            tkinter.messagebox.showerror(title=_('search'),
+                message=str(exc))
+            return
+        except TimeoutError:
+            self.timeout_error(_('search'))
+            return
+        zone = self.zone()
+        zone.tag_remove('found', 1.0, END)
+        if num is not None:
+            start, end = self.matches.span(num)
+            zone.tag_add('found', start, end)
+            self.search_pos = end
+            zone.see(start)
+            self.count.set(_('match_count').format(num + 1,
+                len(self.matches)))
+            self.mark_visible()
             self.editor().print_line_nums()
         else:
+            self.count.set('')
             tkinter.messagebox.showinfo(title=_('search'),
                 message=_('Not found'))
 
+    def make_search_previous(self):
+        self.make_search(backwards=True)
+
+    def mark_visible(self):
+        """Tag the matches in the visible lines of the document."""
+        zone = self.zone()
+        zone.tag_remove('match', 1.0, END)
+        ixs = self.matches.between(*self.editor().get_visible_text())
+        if ixs:
+            zone.tag_add('match', *ixs)
+
     def open_file(self, event):
         zone = event.widget
         file_name, line = zone.links[zone.tag_prevrange('link', CURRENT)]
-        for ix, doc in enumerate(docs):
-            if doc.file_name == file_name:
-                docs[current_doc].editor.remove_functions_browser()
-                switch_to(ix)
-                break
-        else:
-            # not found, open file
-            open_module(file_name)
-        ed = docs[current_doc].editor
-        ed.zone.focus()
-        ed.zone.mark_set(INSERT, '{}.0'.format(line + 1))
-        ed.zone.see(INSERT)
-        ed.print_line_nums()
+        goto_file(file_name, line + 1)
+
+    def file_extensions(self):
+        """Return the extensions of the files searched in files."""
+        extensions = [x.strip() for x in self.extensions.get().split()]
+        return [x if x.startswith('.') else '.' + x for x in extensions]
 
     def make_search_files(self):
         txt = self.searched.get()
-        pattern = txt
-        if full_word.get():
-            for car in '[](){}$^.':
-                pattern = pattern.replace(car, '\\'+car)
-            pattern = r'(^|[^\w\d_$]){}($|[^\w\d_$])'.format(pattern)
-        flags = 0
-        if case_insensitive.get():
-            flags = re.I
-        extensions = [x.strip() for x in self.extensions.get().split()]
-        extensions = [x if x.startswith('.') else '.' + x for x in extensions]
+        try:
+            pattern = filesearch.file_pattern(self.compile_pattern())
+        except re.error as exc:
+            tkinter.messagebox.showerror(title=_('search in files'),
+                message=str(exc))
+            return
+        extensions = self.file_extensions()
         top = Toplevel()
         zone = ScrolledText(top, width=120, height=40)
         zone.links = {}
+        zone.dirpath = None
         zone.pack()
         zone.tag_config('link', foreground="blue", underline=1)
         zone.tag_bind('link', '<Button-1>', self.open_file)
         zone.tag_bind('link', "<Enter>", lambda *args: zone.config(cursor="hand1"))
         zone.tag_bind('link', "<Leave>", lambda *args: zone.config(cursor=""))
-        top.title(_('search_in_files').format(default_dir()))
+        root_dir = default_dir()
+        top.title(_('search_in_files').format(root_dir))
         zone.insert(END, _('string').format(txt))
-        for dirpath, dirnames, filenames in os.walk(default_dir()):
-            flag_dir = False
-            if '.hg' in dirnames:
-                dirnames.remove('.hg')
-            for fname in filenames:
-                if extensions and os.path.splitext(fname)[1] not in extensions:
-                    continue
-                if fname.endswith(('.gz', '.zip')):
-                    continue
-                flag_file = False
-                full_path = os.path.join(dirpath, fname)
-                src = open(full_path, encoding='iso-8859-1').read()
-                rest = src
-                lines = src.split('\n')
-                pos = 0
-                save_lnum = None
-                while True:
-                    try:
-                        mo = re.search(pattern, rest, flags=flags)
-                    except:
-                        print('error with pattern', pattern)
-                        raise
-                    if mo:
-                        if not flag_dir:
-                            zone.insert(END,'\n\n' + dirpath)
-                            flag_dir = True
-                        if not flag_file:
-                            zone.insert(END, '\n   {}\n'.format(
-                                full_path[len(default_dir()) + 1:]))
-                            flag_file = True
-                        pos_in_src = pos + mo.start()
-                        while src[pos_in_src] == '\n':
-                            pos_in_src += 1
-                        lnum = src[:pos_in_src].count('\n')
-                        if lnum != save_lnum:
-                            zone.insert(END, '\n        ')
-                            zone.insert(END, 'line %4s' %(lnum+1), "link")
-                            zone.links[zone.tag_prevrange('link', CURRENT)] = (
-                                full_path, lnum)
-                            zone.insert(END, ' : %s'
-                                %(lines[lnum][:100]))
-                            save_lnum = lnum
-                        pos += mo.start() + len(txt)
-                        rest = rest[mo.start() + len(txt):]
-                    else:
-                        if flag_file:
-                            zone.insert(END, '\n')
-                        break
-
-    def find_next(self, **kw):
+        skipped = None
+        if trigram_index:
+            # don't read the files that don't have the trigrams of the
+            # searched string
+            index = trigrams.get(root_dir, cache_dir)
+            strings = trigrams.literals(txt) if regular_expression.get() \
+                else [txt]
+            strings = [filesearch.encode(string) for string in strings]
+            skipped = lambda: index.skipped(strings)
+        search = filesearch.Search(root_dir, pattern, extensions, skipped,
+            sandboxed=regular_expression.get())
+        progress = Frame(top)
+        progress.label = Label(progress)
+        progress.label.pack(side=LEFT)
+        progress.stop = Button(progress, text=_('stop'), command=search.stop)
+        progress.stop.pack(side=LEFT)
+        progress.pack(anchor=W)
+        def close():
+            search.stop()
+            top.destroy()
+        top.protocol('WM_DELETE_WINDOW', close)
+        self.poll_search_files(search, zone, progress)
+
+    def poll_search_files(self, search, zone, progress):
+        """Show the results found by search since the last call, until the
+        search is done."""
+        if not zone.winfo_exists():
+            return
+        done = search.done
+        results = search.results()
+        if results:
+            self.show_file_results(zone, search.root, results)
+        progress.label['text'] = _('search_progress').format(
+            search.nb_searched, search.nb_files, search.nb_lines)
+        if search.timed_out:
+            progress.label['text'] += ' - ' + _('search_timeout').format(
+                filesearch.search_time_limit)
+        if done:
+            progress.stop['state'] = DISABLED
+            if trigram_index:
+                trigrams.get(search.root, cache_dir).start_update()
+        else:
+            zone.after(100, self.poll_search_files, search, zone, progress)
+
+    def show_file_results(self, zone, root_dir, results):
+        """Insert the results (path, lines) of search in files, with a single
+        insert."""
+        # line number in zone of the next inserted line
+        line = int(zone.index('end-1c').split('.')[0])
+        args = []
+        for full_path, lines in results:
+            if os.path.dirname(full_path) != zone.dirpath:
+                zone.dirpath = os.path.dirname(full_path)
+                args += ['\n\n' + zone.dirpath, ()]
+                line += 2
+            if lines is None:
+                # the search took too long
+                args += ['\n   {} : {}\n'.format(
+                    full_path[len(root_dir) + 1:], _('file_timeout')), ()]
+                line += 2
+                continue
+            args += ['\n   {}\n'.format(full_path[len(root_dir) + 1:]), ()]
+            line += 2
+            for lnum, text in lines:
+                link = 'line %4s' %(lnum + 1)
+                args += ['\n        ', (), link, 'link', ' : ' + text, ()]
+                line += 1
+                zone.links[('{}.8'.format(line),
+                    '{}.{}'.format(line, 8 + len(link)))] = (full_path, lnum)
+            args += ['\n', ()]
+            line += 1
+        zone.insert(END, *args)
+
+    def compile_pattern(self):
+        """Return the Python regular expression for the searched string and
+        the options of the dialog."""
         pattern = self.searched.get()
-        regexp = regular_expression.get()
-        if self.search_end:
-            kw['stopindex'] = self.search_end
+        if not regular_expression.get():
+            pattern = re.escape(pattern)
         if full_word.get():
-            for car in '[](){}$^.':
-                pattern = pattern.replace(car, '\\'+car)
-            pattern = r'(^|[^\w\d_$]){}($|[^\w\d_$])'.format(pattern)
-            regexp = True
-        if case_insensitive.get():
-            pattern = '(?i)' + pattern
-            regexp = True
-        res = self.zone().search(pattern, self.search_pos,
-            count=found_length, regexp=regexp, **kw)
-        ln = found_length.get()
-        if res and full_word.get(): # remove borders
-            line, col = [int(x) for x in res.split('.')]
-            if self.zone().get(res) != self.searched.get()[0]:
-                res = '{}.{}'.format(line, col + 1)
-                ln -= 1
-            if self.zone().get('{}+{}c'.format(res, ln - 1)) != \
-                    self.searched.get()[-1]:
-                ln -= 1
-            found_length.set(ln)
-        return res
+            pattern = r'(?<![\w$]){}(?![\w$])'.format(pattern)
+        return re.compile(pattern, re.I if case_insensitive.get() else 0)
+
+    def find_next(self, backwards=False):
+        """Return the number of the match after self.search_pos, or before it
+        if backwards is set, None if there is no match. The search wraps
+        around if it is not limited to the selection."""
+        zone = self.zone()
+        editor = self.editor()
+        regex = self.compile_pattern()
+        start = zone.index(self.search_start)
+        end = zone.index(self.search_end or 'end-1c')
+        key = (regex.pattern, regex.flags, start, end, editor,
+            editor.revision)
+        if key != self.matches.key:
+            line, col = [int(x) for x in start.split('.')]
+            self.matches.find(key, regex, zone.get(start, end), line, col,
+                sandboxed=regular_expression.get())
+        line, col = [int(x) for x in zone.index(self.search_pos).split('.')]
+        wrap = self.search_end is None
+        if backwards:
+            return self.matches.previous(line, col, wrap)
+        return self.matches.next(line, col, wrap)
 
     def replace(self):
         self.search(repl=True)
 
+    def timeout_error(self, title):
+        tkinter.messagebox.showerror(title=title,
+            message=_('regex_timeout').format(sandbox.time_limit))
+
+    def replace_in_files(self):
+        self.search(repl=True, files=True)
+
     def search_in_files(self):
         self.search(files=True)
 
     def make_replace(self):
         self.set_search_boundaries()
-        pos = self.find_next()
-        if pos:
+        try:
+            num = self.find_next()
+        except re.error as exc:
+            tkinter.messagebox.showerror(title=_('replace'),
+                message=str(exc))
+            return
+        except TimeoutError:
+            self.timeout_error(_('replace'))
+            return
+        if num is not None:
             zone = self.zone()
             zone.tag_remove('found', 1.0, END)
-            end_pos = '{}+{}c'.format(pos, found_length.get())
+            pos, end_pos = self.matches.span(num)
             found = zone.get(pos, end_pos)
-            zone.delete(pos, end_pos)
             if regular_expression.get():
-                repl = re.sub(self.searched.get(), self.replacement.get(),
+                repl = self.compile_pattern().sub(self.replacement.get(),
                     found)
             else:
                 repl = self.replacement.get()
-            zone.insert(pos, repl)
+            zone.replace(pos, end_pos, repl)
             self.search_pos = '{}+{}c'.format(pos, len(repl))
             self.editor().syntax_highlight()
             zone.tag_add('found', pos, '{}+{}c'.format(pos, len(repl)))
             zone.see(pos)
 
     def make_replace_all(self):
-        self.set_search_boundaries()
-        # keep undo stack separator at position before replace all
+        """Replace all the matches in the selection, or in the document if
+        there is no selection. The substitution is done on a copy of the
+        text, and the text between the first and the last match is replaced
+        in a single edit."""
         zone = self.zone()
+        selected = zone.tag_ranges(SEL)
+        if selected:
+            start, end = [str(ix) for ix in selected]
+        else:
+            start, end = '1.0', zone.index('{}-1c'.format(END))
+        txt = zone.get(start, end)
+        replacement = self.replacement.get()
+        if not regular_expression.get():
+            replacement = replacement.replace('\\', '\\\\')
+        try:
+            regex = self.compile_pattern()
+            if regular_expression.get():
+                result, found, first, last = sandbox.call(
+                    matches.substitute, regex, replacement, txt)
+            else:
+                result, found, first, last = matches.substitute(regex,
+                    replacement, txt)
+        except re.error as exc:
+            tkinter.messagebox.showerror(title=_('replace all'),
+                message=str(exc))
+            return
+        except TimeoutError:
+            self.timeout_error(_('replace all'))
+            return
+        if not found:
+            tkinter.messagebox.showinfo(title=_('replace all'),
+                message=_('Not found'))
+            return
+        revision = self.editor().revision
+        self.replace_text(zone, start, txt, first, last,
+            result[first:len(result) - len(txt) + last])
+        if self.editor().revision == revision:
+            # the edit was refused : the replacement can't be encoded in
+            # the encoding of the document (see Editor.run_command)
+            return
+        zone.tag_remove('found', 1.0, END)
+        self.editor().syntax_highlight()
+        tkinter.messagebox.showinfo(title=_('replace all'),
+            message=_('nb_replaced').format(found))
+
+    def make_replace_files(self):
+        try:
+            regex = self.compile_pattern()
+        except re.error as exc:
+            tkinter.messagebox.showerror(title=_('replace in files'),
+                message=str(exc))
+            return
+        replacement = self.replacement.get()
+        if not regular_expression.get():
+            replacement = replacement.replace('\\', '\\\\')
+        # text and revision of the open documents
+        texts, revisions = {}, {}
+        for doc in docs:
+            if doc.has_name:
+                texts[doc.file_name] = doc.editor.zone.get(1.0,
+                    '{}-1c'.format(END))
+                revisions[doc.file_name] = doc.editor.revision
+        root_dir = default_dir()
+        replace = filereplace.Replace(root_dir, regex, replacement,
+            self.file_extensions(), encoding_for_next_open.get(), texts,
+            revisions, sandboxed=regular_expression.get())
+        top = Toplevel()
+        top.title(_('replace_in_files').format(root_dir))
+        zone = ScrolledText(top, width=120, height=40)
+        zone.pack()
+        zone.tag_config('added', foreground='green')
+        zone.tag_config('removed', foreground='red')
+        zone.tag_config('hunk', foreground='blue')
+        progress = Frame(top)
+        progress.label = Label(progress)
+        progress.label.pack(side=LEFT)
+        progress.stop = Button(progress, text=_('stop'),
+            command=replace.stop)
+        progress.stop.pack(side=LEFT)
+        progress.apply = Button(progress, text=_('replace'), state=DISABLED,
+            command=lambda: self.apply_changes(replace, top))
+        progress.apply.pack(side=LEFT)
+        progress.pack(anchor=W)
+        def close():
+            replace.stop()
+            top.destroy()
+        top.protocol('WM_DELETE_WINDOW', close)
+        self.poll_replace_files(replace, zone, progress)
+
+    def poll_replace_files(self, replace, zone, progress):
+        """Show the progress of replace in files, then the diff of each file
+        when the replacements are computed."""
+        if not zone.winfo_exists():
+            return
+        progress.label['text'] = _('replace_progress').format(
+            replace.nb_done, replace.nb_files)
+        if not replace.done:
+            zone.after(100, self.poll_replace_files, replace, zone,
+                progress)
+            return
+        progress.stop['state'] = DISABLED
+        tags = {'+': 'added', '-': 'removed', '@': 'hunk'}
+        for change in replace.changes:
+            # the file is replaced if its box is checked
+            change.accepted = BooleanVar(zone, True)
+            zone.window_create(END, window=Checkbutton(zone,
+                variable=change.accepted, text='{} ({})'.format(
+                    change.path[len(replace.root) + 1:], change.count)))
+            args = ['\n', ()]
+            for line in change.diff:
+                args += [line + '\n', tags.get(line[:1], ())]
+            args += ['\n', ()]
+            zone.insert(END, *args)
+        for path, exc in replace.errors:
+            zone.insert(END, '{} : {}\n'.format(
+                path[len(replace.root) + 1:], exc))
+        progress.label['text'] = _('nb_replaced_files').format(
+            sum(change.count for change in replace.changes),
+            len(replace.changes))
+        if replace.changes:
+            progress.apply['state'] = NORMAL
+
+    def apply_changes(self, replace, top):
+        """Write the accepted changes of replace in files to the files, or
+        to the editors of the open documents."""
+        changes = [change for change in replace.changes
+            if change.accepted.get()]
+        top.destroy()
+        errors = filereplace.write([change for change in changes
+            if change.stat is not None])
+        open_docs = {doc.file_name: doc for doc in docs if doc.has_name}
+        for change in changes:
+            if change.stat is not None:
+                continue
+            doc = open_docs.get(change.path)
+            if doc is None or \
+                    doc.editor.revision != replace.revisions[change.path]:
+                errors.append((change, _('modified')))
+                continue
+            first, last, new = change.span
+            self.replace_text(doc.editor.zone, '1.0',
+                replace.texts[change.path], first, last, new)
+            if doc is docs[current_doc]:
+                doc.editor.syntax_highlight()
+        file_browser.mark_if_changed()
+        message = _('nb_replaced_files').format(
+            sum(change.count for change in changes) -
+            sum(change.count for change, exc in errors),
+            len(changes) - len(errors))
+        for change, exc in errors:
+            message += '\n{} : {}'.format(change.path, exc)
+        tkinter.messagebox.showinfo(title=_('replace in files'),
+            message=message)
+
+    def replace_text(self, zone, start, txt, first, last, new):
+        """txt is the text of zone from index start : replace the text
+        between its offsets first and last by new, in a single undo
+        step."""
+        line, col = [int(x) for x in zone.index(start).split('.')]
+        lines = lineindex.LineIndex(txt, line, col)
+        # keep undo stack separator at position before the replacement
         zone['autoseparators'] = False
-        if not zone.tag_ranges(SEL):
-            self.search_pos = 1.0
-            self.search_end = END
-        found = 0
-        while True:
-            pos = self.find_next(stopindex=self.search_end)
-            if not pos:
-                break
-            found += 1
-            zone.delete(pos,'{}+{}c'.format(pos, found_length.get()))
-            zone.insert(pos,self.replacement.get())
-            self.search_pos = '{}+{}c'.format(pos,
-                len(self.replacement.get()))
-        if found:
-            zone.tag_remove('found', 1.0, END)
-            self.editor().syntax_highlight()
-            # manually add separator in undo stack
-            zone.edit_separator()
-        zone['autoseparator'] = True # reset to default
+        zone.edit_separator()
+        zone.replace(lines.index(first), lines.index(last), new)
+        zone.edit_separator()
+        zone['autoseparators'] = True # reset to default
 
 def ask_module(*args):
     file_name = askopenfilename(initialdir=default_dir())
@@ -1173,13 +1767,13 @@ def _close(*args):
     global current_doc
     if not docs:
         return
-    if (docs[current_doc].editor.zone.get(1.0, '{}-1c'.format(END)) !=
-            docs[current_doc].text):
+    if docs[current_doc].editor.is_modified():
         flag = tkinter.messagebox.askquestion("File modified",
             "File {} changed. Save it ?".format(docs[current_doc].file_name))
         if flag != 'no' and not save():
             return
     docs[current_doc].editor.frame.pack_forget()
+    docs[current_doc].editor.scheduler.cancel_all()
     del docs[current_doc]
     file_browser.update()
     if docs:
@@ -1224,40 +1818,32 @@ def default_dir():
     except IOError:
         return os.getcwd()
 
-def guess_linefeed(txt):
-    # guess if linefeed in text is \n, \r\n or \r
-    counts = txt.count('\n'), txt.count('\r\n'), txt.count('\r')
-    if counts[0] > counts[1]:
-        return 'Unix: \\n'
-    elif counts[2] > counts[1]:
-        return 'Mac: \\r'
-    return 'DOS: \\r\\n'
-
-def html_encoding(html):
-    # form <meta charset="...">
-    mo = re.search(r'<meta\s+charset="(.*?)"\s*/?>', html, re.I)
-    if mo:
-        return mo.groups(0)[0]
-    # form <meta http-equiv="content-type" type="...;charset=...">
-    pattern = r'<meta\s+http-equiv\s*=\s*"content-type"\s+content\s*=\s*(.+?)".*/?>'
-    mo = re.search(pattern, html, re.I)
-    if mo:
-        content = mo.groups()[0]
-        mo = re.search(r'charset\s*=\s*(.+)', content, re.I + re.S)
-        if mo:
-            return mo.groups()[0]
+def goto_file(file_name, line_num):
+    """Show line line_num of file_name, opened if it is not open yet."""
+    for ix, doc in enumerate(docs):
+        if doc.file_name == file_name:
+            docs[current_doc].editor.remove_functions_browser()
+            switch_to(ix)
+            break
+    else:
+        # not found, open file
+        open_module(file_name)
+    ed = docs[current_doc].editor
+    ed.zone.focus()
+    ed.zone.mark_set(INSERT, '{}.0'.format(line_num))
+    ed.zone.see(INSERT)
+    ed.print_line_nums()
 
 def make_patterns(*args):
     importlib.reload(langs["python"])
-    kw_pattern = '|'.join([r'\b{}\b'.format(kw)
-        for kw in langs["python"].keywords])
-    builtins_pattern = '|'.join([r'\b{}\b'.format(b)
-        for b in langs["python"].builtins])
-    patterns['.py'] = [(kw_pattern, 'keyword'), (builtins_pattern, 'builtin')]
-    patterns['.py']+=[(square_brackets, 'square_bracket'),
-        (parenthesis, 'parenthesis'), (curly_braces, 'curly_brace')]
+    lexers["python"] = lexer.Lexer(langs["python"])
+    workers.reset()
+    for doc in docs:
+        doc.editor.line_cache.clear()
     if docs:
-        docs[current_doc].editor.syntax_highlight()
+        editor = docs[current_doc].editor
+        editor.line_states = None # highlight the whole document
+        editor.syntax_highlight()
 
 def new_module(ext):
     global current_doc
@@ -1300,14 +1886,14 @@ def open_module(file_name, force_reload=False, force_encoding=None):
         src = open(file_name)
         try:
             head = src.readline() + src.readline()
-            file_encoding = py_encoding(head)
+            file_encoding = fileformat.py_encoding(head)
         except UnicodeDecodeError:
             pass
     elif extension in ['.html','.htm']:
         # search a meta tag with charset
         if force_encoding is None:
             with open(file_name, newline="", errors='ignore') as fobj:
-                file_encoding = html_encoding(fobj.read())
+                file_encoding = fileformat.html_encoding(fobj.read())
             if not file_encoding:
                 tkinter.messagebox.showwarning(title=_('HTML encoding'),
                         message=_('Charset not found'))
@@ -1316,7 +1902,7 @@ def open_module(file_name, force_reload=False, force_encoding=None):
     try:
         txt = open(file_name, 'r', encoding=file_encoding).read()
         txt = txt.replace('\t', ' ' * spaces_per_tab.get())
-        linefeed.set(guess_linefeed(txt))
+        linefeed.set(fileformat.guess_linefeed(txt))
         # internally use \n, otherwise tkinter adds an extra whitespace
         # for each line
         txt = txt.replace('\r\n', '\n')
@@ -1346,14 +1932,14 @@ def open_module(file_name, force_reload=False, force_encoding=None):
     editor = Editor()
     if extension in (".html", ".htm"):
         editor.spaces_per_tab.set(2)
+    editor.encoding.set(file_encoding)
     editor.zone.insert(1.0, txt)
-    text = editor.zone.get(1.0, '{}-1c'.format(END))
+    editor.set_saved(editor.zone.get(1.0, '{}-1c'.format(END)))
     if docs:
         docs[current_doc].editor.frame.pack_forget()
     root.title('TedPy - {}'.format(file_name))
-    new_doc = Document(file_name, text=text)
+    new_doc = Document(file_name)
     new_doc.editor = editor
-    new_doc.editor.encoding.set(file_encoding)
     new_doc.last_modif = os.stat(file_name).st_mtime
     docs.append(new_doc)
     file_browser.update()
@@ -1364,20 +1950,19 @@ def open_module(file_name, force_reload=False, force_encoding=None):
     editor.syntax_highlight()
     editor.zone.edit_reset()
     editor.frame.pack(expand=YES, fill=BOTH)
-    # wait to print lines, otherwise bbox only works for first line
+    # wait to print lines, otherwise dlineinfo only works for first line
     editor.zone.after(100, editor.print_line_nums)
     save_history(new_doc)
     new_doc.editor.zone.focus()
 
-def py_encoding(head):
-    mo = re.search(r'(?s)coding\s*[:=]\s*([-\w.]+)', head, re.M)
-    if mo:
-        return mo.groups()[0]
-
 def replace(*args):
     if docs:
         Searcher().replace()
 
+def replace_in_files(*args):
+    if docs:
+        Searcher().replace_in_files()
+
 def run(*args):
     if not docs or not docs[current_doc].editor.zone.get(1.0, END).strip():
         return
@@ -1515,12 +2100,12 @@ def save_zone():
     doc = docs[current_doc]
     zone = doc.editor.zone
     enc = doc.editor.encoding.get()
+    text = zone.get(1.0, '{}-1c'.format(END))
     try:
-        data = zone.get(1.0, '{}-1c'.format(END)).encode(enc)
+        data = text.encode(enc)
     except UnicodeEncodeError as msg:
         message = _('cannot_encode').format(enc)
         start = msg.start
-        text = zone.get(1.0,'{}-1c'.format(END))
         line = 1 + text[:start].count('\n')
         if line==1:
             col = start
@@ -1535,7 +2120,7 @@ def save_zone():
     data = set_linefeed(data)
     with open(doc.file_name, 'wb') as out:
         out.write(data)
-    doc.text = zone.get(1.0, '{}-1c'.format(END))
+    doc.editor.set_saved(text)
     save_history(doc)
     file_browser.mark_if_changed()
     return True
@@ -1570,18 +2155,23 @@ def set_sizes():
     file_browser['width'] = int(0.15 * ratio)
     for doc in docs:
         doc.editor.zone['width'] = int(0.85 * ratio)
+        doc.editor.line_nums.invalidate()
+        doc.editor.scheduler.schedule('line_nums',
+            doc.editor.print_line_nums)
 
 def set_linefeed(txt):
     """Normalise linefeed"""
-    lf = linefeed.get()
-    # set all linefeeds to \n
-    txt = txt.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
-    if lf == 'Unix: \\n':
-        return txt
-    elif lf == 'Mac: \\r':
-        return txt.replace(b'\n', b'\r')
-    else:
-        return txt.replace(b'\n', b'\r\n')
+    return fileformat.set_linefeed(txt, linefeed.get())
+
+def symbol_languages():
+    """Return the struct_patterns and keywords of the language of each
+    extension, for the index of the definitions."""
+    result = {}
+    for ext, lang in ext2lang.items():
+        struct_patterns = getattr(langs[lang], "struct_patterns", None)
+        if struct_patterns is not None:
+            result[ext] = (struct_patterns, list(langs[lang].keywords))
+    return result
 
 def switch(event):
     if not docs:
@@ -1628,7 +2218,6 @@ case_insensitive = BooleanVar(root)
 case_insensitive.set(True)
 regular_expression = BooleanVar(root)
 regular_expression.set(False)
-found_length = IntVar(root)
 syntax_highlight = BooleanVar(root)
 syntax_highlight.set(True)
 syntax_highlight.trace_add('write', update_highlight)
@@ -1673,6 +2262,8 @@ menuEdition.add_command(label=_('search'), command=search, accelerator="F5")
 menuEdition.add_command(label=_('search in files'), command=search_in_files,
     accelerator="F6")
 menuEdition.add_command(label=_('replace'), command=replace, accelerator="F8")
+menuEdition.add_command(label=_('replace in files'),
+    command=replace_in_files)
 menubar.add_cascade(menu=menuEdition, label=_('edit'))
 
 menuConfig = Menu(menubar, tearoff=0)
@@ -1753,7 +2344,7 @@ class FileBrowser(tkinter.Text):
         line_num = self.doc_line[doc]
         start, end = '{}.0'.format(line_num), '{}.0lineend'.format(line_num)
         lib = self.get(start,end)
-        if doc.editor.zone.get(1.0, END + '-1c') != doc.text:
+        if doc.editor.is_modified():
             if not lib.endswith('*'):
                 self.insert(end, '*', 'selected')
         elif lib.endswith('*'):
@@ -1792,5 +2383,9 @@ check_file_change()
 if len(sys.argv) > 1:
     open_module(sys.argv[1])
 
+if symbol_index:
+    # index the files changed since the last session
+    symbols.get(default_dir(), cache_dir).start_update(symbol_languages())
+
 root.mainloop()
 
@@ -0,0 +1,76 @@
+"""Memory used to compute the highlighting of a large Python file.
+
+Compares the mapping between offsets and positions used before (a list of
+characters and a (line, col) tuple per character) with the line index used
+now, and measures the whole highlighting computation without Tk : lexing,
+line index, tokens of each line.
+
+Usage : python benchmarks/highlight_memory.py [file_name [size_in_MB]]
+"""
+
+import gc
+import importlib
+import os
+import sys
+import tracemalloc
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+
+import lexer
+import lineindex
+import renderer
+
+
+def per_char_mapping(txt):
+    """The structures built by highlight_lang before the line index."""
+    ltxt = list(txt)
+    lc = []
+    line, col = 1, 0
+    for car in txt:
+        lc.append((line, col))
+        col += 1
+        if car == '\n':
+            line += 1
+            col = 0
+    lc.append((line, col))
+    return ltxt, lc
+
+
+def line_index(txt):
+    return lineindex.LineIndex(txt)
+
+
+def highlight(txt):
+    spans, states = lexers['python'].tokenize(txt)
+    lines = lineindex.LineIndex(txt)
+    return renderer.split_lines(spans, lines)
+
+
+def measure(func, txt):
+    gc.collect()
+    collections = sum(stat['collections'] for stat in gc.get_stats())
+    tracemalloc.start()
+    result = func(txt)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    collections = sum(stat['collections'] for stat in gc.get_stats()) - \
+        collections
+    del result
+    print('{:<20} peak {:8.1f} MB  gc collections {:6}'.format(
+        func.__name__, peak / 2 ** 20, collections))
+
+
+if __name__ == '__main__':
+    file_name = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.join(os.path.dirname(this_dir), 'TedPy.py')
+    size = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with open(file_name, encoding='utf-8') as f:
+        src = f.read()
+    txt = src * max(1, int(size * 2 ** 20 / len(src)))
+    lexers = {'python': lexer.Lexer(importlib.import_module(
+        'languages.python'))}
+    print('{} : {:.1f} MB, {} lines'.format(file_name, len(txt) / 2 ** 20,
+        txt.count('\n')))
+    for func in (per_char_mapping, line_index, highlight):
+        measure(func, txt)
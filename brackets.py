@@ -0,0 +1,194 @@
+"""Index of the brackets of a document, for brace matching.
+
+The brackets of each line are taken from the highlighting tokens, so that
+the brackets in strings and comments are ignored. When a line is edited,
+its brackets are unknown until it is highlighted again. The pairs of
+matching brackets are computed from the brackets of all the lines, without
+reading the text widget : finding the bracket that matches another one is
+a dictionary lookup.
+A bracket only matches a bracket of the same kind, the other brackets are
+ignored : in "( [ ) ]" the parenthesis match, and so do the square
+brackets.
+The pairs are kept when lines are edited : the brackets are identified by
+a number given to their line, that doesn't change when lines are inserted
+or removed before it. If the edited lines have the same sequence of
+brackets as before the edit (the usual case when typing), only the
+brackets of these lines are updated ; otherwise all the pairs are computed
+again.
+"""
+
+# tags of the bracket tokens
+bracket_tags = ('parenthesis', 'curly_brace', 'square_bracket')
+# opening bracket for each closing bracket
+opening = {')': '(', ']': '[', '}': '{'}
+
+
+class BracketIndex:
+
+    def __init__(self):
+        # brackets of each line : list of (col, char), None if unknown
+        self.lines = []
+        # number of each line, kept when other lines are edited
+        self.ids = []
+        self.next_id = 0
+        # position (line id, col) of the bracket that matches each bracket,
+        # None if they must be computed again
+        self.pairs = None
+        # positions (line id, col) of the brackets that have no match
+        self.lone = set()
+        # lines edited since the pairs were computed : list of (brackets
+        # before the edits as (line id, col, char), ids of the lines)
+        self.edits = []
+
+    def clear(self):
+        self.lines = []
+        self.ids = []
+        self.pairs = None
+        self.edits = []
+
+    def complete(self):
+        """Return True if the brackets of all the lines are known."""
+        return None not in self.lines
+
+    def edited(self, first, old_last, new_last):
+        """Lines first to old_last were replaced by lines first to
+        new_last : their brackets are unknown."""
+        old_ids = self.ids[first - 1:old_last]
+        new_ids = list(range(self.next_id,
+            self.next_id + new_last - first + 1))
+        self.next_id += len(new_ids)
+        if self.pairs is not None:
+            self.add_edit(first, old_last, old_ids, new_ids)
+        self.lines[first - 1:old_last] = [None] * len(new_ids)
+        self.ids[first - 1:old_last] = new_ids
+
+    def add_edit(self, first, old_last, old_ids, new_ids):
+        """Keep the brackets that lines first to old_last had before the
+        edits, to compare them with their new brackets (see update()). The
+        edits that overlap these lines are merged."""
+        old_set = set(old_ids)
+        merged = [edit for edit in self.edits
+            if not old_set.isdisjoint(edit[1])]
+        others = [edit for edit in self.edits
+            if old_set.isdisjoint(edit[1])]
+        # edit of each line of the merged edits
+        owner = {}
+        start, end = first, old_last
+        for num, (old, line_ids) in enumerate(merged):
+            owner.update(dict.fromkeys(line_ids, num))
+            pos = self.ids.index(line_ids[0]) + 1
+            start, end = min(start, pos), max(end, pos + len(line_ids) - 1)
+        old = []
+        done = set()
+        for num in range(start - 1, end):
+            line_id = self.ids[num]
+            if line_id in owner:
+                if owner[line_id] not in done:
+                    done.add(owner[line_id])
+                    old += merged[owner[line_id]][0]
+            elif self.lines[num] is None:
+                # brackets not known before the edit
+                self.pairs = None
+                return
+            else:
+                old += [(line_id, col, char)
+                    for col, char in self.lines[num]]
+        self.edits = others + [(old, self.ids[start - 1:first - 1] +
+            new_ids + self.ids[old_last:end])]
+
+    def lone_lines(self):
+        """Return the positions (line, col) of the brackets that have no
+        match."""
+        nums = {line_id: num for num, line_id in enumerate(self.ids,
+            start=1)}
+        return sorted((nums[line_id], col) for line_id, col in self.lone)
+
+    def match(self, line, col):
+        """Return the position of the bracket that matches the bracket at
+        position line, col, None if there is no match."""
+        self.update()
+        match = self.pairs.get((self.ids[line - 1], col))
+        if match is not None:
+            return self.ids.index(match[0]) + 1, match[1]
+
+    def set_lines(self, first, texts, tokens):
+        """Set the brackets of lines first, first + 1, etc. texts is the
+        text of these lines, tokens are their highlighting tokens (see
+        renderer.py)."""
+        if len(self.lines) < first - 1 + len(tokens):
+            nb = first - 1 + len(tokens) - len(self.lines)
+            self.lines += [None] * nb
+            self.ids += range(self.next_id, self.next_id + nb)
+            self.next_id += nb
+            self.pairs = None
+        for num, (text, line_tokens) in enumerate(zip(texts, tokens),
+                start=first - 1):
+            brackets = sorted((start, text[start])
+                for (start, end, tag) in line_tokens if tag in bracket_tags)
+            if brackets != self.lines[num]:
+                if self.lines[num] is not None:
+                    # highlighted again with another lexer state
+                    self.pairs = None
+                self.lines[num] = brackets
+
+    def update(self):
+        """Compute the pairs of matching brackets if the brackets changed.
+        Return True if the brackets that have no match changed."""
+        moved_lone = False
+        if self.pairs is not None and self.edits:
+            moved_lone = self.update_edits()
+        if self.pairs is not None:
+            return moved_lone
+        self.edits = []
+        self.pairs = pairs = {}
+        # opened brackets of each kind, not closed yet
+        stacks = {'(': [], '[': [], '{': []}
+        self.lone = lone = set()
+        for line_id, brackets in zip(self.ids, self.lines):
+            if not brackets:
+                continue
+            for col, char in brackets:
+                if char in stacks:
+                    stacks[char].append((line_id, col))
+                elif stacks[opening[char]]:
+                    start = stacks[opening[char]].pop()
+                    pairs[start] = (line_id, col)
+                    pairs[(line_id, col)] = start
+                else:
+                    lone.add((line_id, col))
+        for stack in stacks.values():
+            lone.update(stack)
+        return True
+
+    def update_edits(self):
+        """Move the pairs of the brackets of the edited lines to their new
+        position if these lines have the same sequence of brackets as
+        before the edits, otherwise set self.pairs to None. Return True if
+        brackets that have no match were moved."""
+        moves = {}
+        for old, line_ids in self.edits:
+            pos = self.ids.index(line_ids[0])
+            new = [(line_id, col, char) for line_id, brackets in
+                zip(line_ids, self.lines[pos:pos + len(line_ids)])
+                for col, char in brackets]
+            if [char for line_id, col, char in old] != \
+                    [char for line_id, col, char in new]:
+                self.pairs = None
+                return False
+            moves.update(((line_id, col), (new_id, new_col))
+                for (line_id, col, char), (new_id, new_col, new_char)
+                in zip(old, new))
+        self.edits = []
+        pairs = self.pairs
+        moved = {}
+        for old_pos, new_pos in moves.items():
+            match = pairs.pop(old_pos, None)
+            if match is not None:
+                moved[new_pos] = moves.get(match, match)
+        for pos, match in moved.items():
+            pairs[pos] = match
+            pairs[match] = pos
+        lone = self.lone & moves.keys()
+        self.lone -= lone
+        self.lone.update(moves[pos] for pos in lone)
+        return bool(lone)
@@ -0,0 +1,63 @@
+"""Encoding and linefeed of the files.
+
+The encoding of a Python script is read in its encoding declaration (PEP
+263), the encoding of an HTML document in its <meta> tags.
+"""
+
+import os
+import re
+
+
+def file_encoding(file_name, data):
+    """Return the encoding declared in file_name, whose content is data
+    (bytes), None if there is no declaration."""
+    extension = os.path.splitext(file_name)[1]
+    if extension == '.py':
+        head = b'\n'.join(data.split(b'\n', 2)[:2])
+        return py_encoding(head.decode('iso-8859-1'))
+    elif extension in ['.html', '.htm']:
+        return html_encoding(data.decode('iso-8859-1'))
+
+
+def guess_linefeed(txt):
+    # guess if linefeed in text is \n, \r\n or \r
+    counts = txt.count('\n'), txt.count('\r\n'), txt.count('\r')
+    if counts[0] > counts[1]:
+        return 'Unix: \\n'
+    elif counts[2] > counts[1]:
+        return 'Mac: \\r'
+    return 'DOS: \\r\\n'
+
+
+def html_encoding(html):
+    # form <meta charset="...">
+    mo = re.search(r'<meta\s+charset="(.*?)"\s*/?>', html, re.I)
+    if mo:
+        return mo.groups(0)[0]
+    # form <meta http-equiv="content-type" type="...;charset=...">
+    pattern = r'<meta\s+http-equiv\s*=\s*"content-type"\s+content\s*=\s*(.+?)".*/?>'
+    mo = re.search(pattern, html, re.I)
+    if mo:
+        content = mo.groups()[0]
+        mo = re.search(r'charset\s*=\s*(.+)', content, re.I + re.S)
+        if mo:
+            return mo.groups()[0]
+
+
+def py_encoding(head):
+    mo = re.search(r'(?s)coding\s*[:=]\s*([-\w.]+)', head, re.M)
+    if mo:
+        return mo.groups()[0]
+
+
+def set_linefeed(txt, lf):
+    """Normalise the linefeeds of txt (bytes) to lf, one of the values of
+    guess_linefeed()."""
+    # set all linefeeds to \n
+    txt = txt.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    if lf == 'Unix: \\n':
+        return txt
+    elif lf == 'Mac: \\r':
+        return txt.replace(b'\n', b'\r')
+    else:
+        return txt.replace(b'\n', b'\r\n')
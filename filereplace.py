@@ -0,0 +1,184 @@
+"""Replace in files.
+
+The replacements are computed for all the files of a directory by a pool of
+threads, in a thread (see class Replace) : for each file that has matches,
+the result is a Change with the new text and the diff shown in the preview.
+The files are decoded with the encoding found as when they are opened in
+the editor, and their linefeeds are kept.
+The accepted changes are written by write() in a pool of threads. Each
+file is written in a temporary file in the same directory, which then
+replaces the file : a file is never left half written.
+The open documents are not read from disk : the replacements are computed
+on the text of their editor, and applied in the editor.
+"""
+
+import concurrent.futures
+import difflib
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import fileformat
+import filesearch
+import matches
+import sandbox
+import walker
+
+
+def compute(path, regex, replacement, default_encoding, txt=None,
+        size_limit=None):
+    """Return the Change for the replacement of the matches of regex in file
+    path, None if there is no match. txt is the text of the file if it is
+    open in the editor, otherwise the file is read with its encoding, or
+    default_encoding if it is not declared. Files larger than size_limit
+    (filesearch.max_size by default) are skipped."""
+    encoding = linefeed = stat = None
+    if txt is None:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size > (size_limit or filesearch.max_size):
+                return None
+            data = f.read()
+        if filesearch.is_binary(data):
+            return None
+        encoding = fileformat.file_encoding(path, data) or default_encoding
+        txt = data.decode(encoding)
+        linefeed = fileformat.guess_linefeed(txt)
+    new, count, first, last = matches.substitute(regex, replacement, txt)
+    if not count:
+        return None
+    diff = difflib.unified_diff(txt.splitlines(), new.splitlines(),
+        lineterm='', n=1)
+    # the first 2 lines have the file names
+    diff = list(diff)[2:]
+    return Change(path, count, new, diff, encoding, linefeed, stat,
+        (first, last, new[first:len(new) - len(txt) + last]))
+
+
+def compute_sandboxed(path, regex, replacement, default_encoding, txt=None):
+    """Run compute() in a worker process, raise TimeoutError if it takes too
+    long."""
+    # the worker process doesn't have the configured size limit
+    return sandbox.call(compute, path, regex, replacement, default_encoding,
+        txt, filesearch.max_size)
+
+
+def write(changes, max_workers=None):
+    """Write the new text of the changes to their files. Return the list of
+    the (change, exception) for the files that could not be written."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        results = executor.map(write_file, changes)
+        return [(change, exc) for change, exc in zip(changes, results)
+            if exc is not None]
+
+
+def write_file(change):
+    """Write the new text of change, return None or the exception that
+    prevented it."""
+    path = change.path
+    try:
+        stat = os.stat(path)
+        if (stat.st_mtime_ns, stat.st_size) != (change.stat.st_mtime_ns,
+                change.stat.st_size):
+            raise OSError('the file was modified')
+        data = change.new.encode(change.encoding)
+        data = fileformat.set_linefeed(data, change.linefeed)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+            prefix='.' + os.path.basename(path) + '.')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(data)
+            shutil.copymode(path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except (OSError, UnicodeError) as exc:
+        return exc
+
+
+class Change:
+    """Replacements in a file."""
+
+    def __init__(self, path, count, new, diff, encoding, linefeed, stat,
+            span):
+        self.path = path
+        # number of replacements
+        self.count = count
+        # new text of the file, lines of the diff with the current text
+        self.new = new
+        self.diff = diff
+        # encoding, linefeed and result of os.stat() of the file ; None for
+        # an open document
+        self.encoding = encoding
+        self.linefeed = linefeed
+        self.stat = stat
+        # for an open document, the text between the offsets of the start of
+        # the first match and the end of the last match is replaced by the
+        # string in span
+        self.span = span
+
+
+class Replace:
+    """Replace in files run in a thread. When it is done, the changes are
+    in self.changes."""
+
+    def __init__(self, root, regex, replacement, extensions,
+            default_encoding, texts, revisions, sandboxed=False):
+        """Replace the matches of regex by replacement in the files under
+        directory root that have one of the extensions (all the files if
+        extensions is empty). texts maps the path of the open documents to
+        their text, and revisions to the revision of their editor. If
+        sandboxed is set, the replacements are computed in worker processes
+        (see sandbox.py)."""
+        self.root = root
+        self.args = (regex, replacement, default_encoding)
+        self.extensions = extensions
+        self.texts = texts
+        # to know if the open documents were edited since
+        self.revisions = revisions
+        self.sandboxed = sandboxed
+        # Change of each file with matches, in the order of the walk
+        self.changes = []
+        # (path, exception) for the files that could not be read, decoded,
+        # or took too long
+        self.errors = []
+        # progress : number of files, files done
+        self.nb_files = self.nb_done = 0
+        self.done = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def compute(self, path):
+        if self.stopped.is_set():
+            return None
+        func = compute_sandboxed if self.sandboxed else compute
+        try:
+            return func(path, *self.args, self.texts.get(path))
+        except (OSError, UnicodeError, LookupError, TimeoutError,
+                re.error) as exc:
+            return exc
+
+    def run(self):
+        try:
+            paths = walker.walk(self.root, self.extensions)
+            self.nb_files = len(paths)
+            max_workers = os.cpu_count() if self.sandboxed else None
+            with concurrent.futures.ThreadPoolExecutor(max_workers) \
+                    as executor:
+                for path, result in zip(paths,
+                        executor.map(self.compute, paths)):
+                    # counted in this thread, not by the threads of the pool
+                    self.nb_done += 1
+                    if isinstance(result, Change):
+                        self.changes.append(result)
+                    elif result is not None:
+                        self.errors.append((path, result))
+        finally:
+            self.done = True
+
+    def stop(self):
+        self.stopped.set()
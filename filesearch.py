@@ -0,0 +1,200 @@
+"""Search of a regular expression in the files of a directory.
+
+The files are searched concurrently by a pool of threads, and the results
+are generated in the order of the walk of the directory, with the names
+sorted in each directory, so that they don't depend on the speed of each
+search.
+A file is read in one call, or memory-mapped if it is large, and decoded as
+if it was encoded in iso-8859-1, that is one character per byte : the
+regular expression for str is used, with the Unicode meaning of \w and \b.
+The line numbers are computed while moving from a match to the next one,
+the text of the file is never split in lines.
+The search is run in a thread (see class Search) : the editor reads the
+results while they are found, and can stop the search.
+"""
+
+import concurrent.futures
+import mmap
+import os
+import queue
+import re
+import threading
+import time
+
+import sandbox
+import walker
+
+# files of at least this size are memory-mapped
+mmap_size = 1 << 20
+# files larger than this size are not searched
+max_size = 10000000
+# a file is binary if its first sniff_size bytes have a null byte
+sniff_size = 8192
+# maximum length of the text of a line in the results
+line_length = 100
+# seconds given to a search in files
+search_time_limit = 300
+
+
+def encode(txt):
+    """Return the bytes searched in the files for the string txt."""
+    try:
+        return txt.encode('iso-8859-1')
+    except UnicodeEncodeError:
+        return txt.encode('utf-8')
+
+
+def file_pattern(regex):
+    """Return the regular expression searched in the text of the files,
+    decoded as iso-8859-1, for the regular expression regex : the
+    characters that are not in iso-8859-1 are searched as their UTF-8
+    bytes. Raise re.error if it is not valid."""
+    return re.compile(encode(regex.pattern).decode('iso-8859-1'),
+        regex.flags)
+
+
+def is_binary(data):
+    return b'\0' in data[:sniff_size]
+
+
+def search(paths, pattern, sandboxed=False, max_workers=None):
+    """Generate (path, lines) for the files in paths, where lines is the
+    result of search_file() for pattern, returned by file_pattern(). If the
+    generator is closed, the files that are not being searched yet are not
+    searched.
+    If sandboxed is set, the files are searched in worker processes (see
+    sandbox.py) : lines is None for a file that took too long to search."""
+    func = search_file
+    if sandboxed:
+        func = search_file_sandboxed
+        max_workers = max_workers or os.cpu_count()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+    try:
+        results = executor.map(func, paths, [pattern] * len(paths))
+        yield from zip(paths, results)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def search_file(path, pattern, size_limit=None):
+    """Return the list of (number, text) of the lines of file path that have
+    a match of pattern (see file_pattern). The first line is number 0.
+    Binary files and files larger than size_limit (max_size by default) are
+    not searched."""
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > (size_limit or max_size):
+                return []
+            if size >= mmap_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return [] if is_binary(data) else \
+                        search_data(str(data, 'iso-8859-1'), pattern)
+            data = f.read()
+            return [] if is_binary(data) else \
+                search_data(data.decode('iso-8859-1'), pattern)
+    except (OSError, ValueError):
+        return []
+
+
+def search_file_sandboxed(path, pattern):
+    """Run search_file() in a worker process, return None if it takes too
+    long."""
+    try:
+        return sandbox.call(search_file, path, pattern, max_size)
+    except TimeoutError:
+        return None
+
+
+def search_data(data, pattern):
+    """Return the lines of data, the decoded text of a file, that have a
+    match of pattern, see search_file()."""
+    lines = []
+    # number and offset of the start of the line of the previous match
+    num, line_start = 0, 0
+    pos = 0
+    end = len(data)
+    while pos <= end:
+        mo = pattern.search(data, pos)
+        if mo is None:
+            break
+        start = mo.start()
+        # a match that starts with line feeds is shown at its next line
+        while start < mo.end() - 1 and data[start] == '\n':
+            start += 1
+        num += data.count('\n', line_start, start)
+        line_start = data.rfind('\n', 0, start) + 1
+        line_end = data.find('\n', start)
+        if line_end == -1:
+            line_end = end
+        text = data[line_start:min(line_end, line_start + line_length)]
+        lines.append((num, text.rstrip('\r')))
+        # the other matches in the line are not shown
+        pos = line_end + 1
+    return lines
+
+
+class Search:
+    """Search in files run in a thread. The results are read from the
+    editor with results(), the thread is stopped by stop()."""
+
+    def __init__(self, root, pattern, extensions, skipped=None,
+            sandboxed=False):
+        """Search pattern, returned by file_pattern(), in the files under
+        directory root that have one of the extensions (all the files if
+        extensions is empty). skipped is a function that returns the set of
+        the files known not to match ; it is called in the thread.
+        sandboxed is passed to search()."""
+        self.root = root
+        self.pattern = pattern
+        self.extensions = extensions
+        self.skipped = skipped
+        self.sandboxed = sandboxed
+        # (path, lines) of the files with matches, or that took too long to
+        # search (lines is None), not read yet
+        self.queue = queue.Queue()
+        # progress : number of files to search, searched, lines found
+        self.nb_files = self.nb_searched = self.nb_lines = 0
+        self.done = False
+        # set if the search was stopped after search_time_limit
+        self.timed_out = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def results(self):
+        """Return the list of the results put in the queue since the last
+        call."""
+        results = []
+        while True:
+            try:
+                results.append(self.queue.get_nowait())
+            except queue.Empty:
+                return results
+
+    def run(self):
+        try:
+            skipped = self.skipped() if self.skipped else set()
+            paths = [path for path in walker.walk(self.root,
+                self.extensions) if path not in skipped]
+            self.nb_files = len(paths)
+            results = search(paths, self.pattern, self.sandboxed)
+            start = time.monotonic()
+            for path, lines in results:
+                if time.monotonic() - start > search_time_limit:
+                    self.timed_out = True
+                    self.stopped.set()
+                if self.stopped.is_set():
+                    results.close()
+                    break
+                self.nb_searched += 1
+                if lines is None:
+                    self.queue.put((path, lines))
+                elif lines:
+                    self.nb_lines += len(lines)
+                    self.queue.put((path, lines))
+        finally:
+            self.done = True
+
+    def stop(self):
+        self.stopped.set()
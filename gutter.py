@@ -0,0 +1,124 @@
+"""Line numbers at the left of a text widget.
+
+The numbers are text items of a Canvas, placed at the height of the first
+display line of each visible line. The number of display lines of each
+line (more than one if the line is wrapped) is kept until the line is
+edited, or the width or the wrap mode of the text widget change.
+The items are drawn again only if the view changed : when the text is
+scrolled, the items of the lines that are still visible are moved with a
+single command, and the items of the lines that are no longer visible are
+reused for the new ones.
+"""
+
+from tkinter import Canvas
+
+
+class Gutter:
+
+    def __init__(self, master, text, font, bg, fg):
+        self.text = text
+        self.font = font
+        self.fg = fg
+        self.canvas = Canvas(master, background=bg, highlightthickness=0,
+            width=3 * font.measure('0'))
+        # number of display lines of each line, None if unknown
+        self.counts = []
+        # width, height and wrap mode of the text widget when counts were
+        # computed
+        self.layout = None
+        # first line, its y and number of lines of the last drawing
+        self.view = None
+        # number of digits of the line numbers, and x of their right side
+        self.nb_chars = 0
+        self.x = 0
+        # line number -> (item, y) of the items on the canvas
+        self.items = {}
+
+    def display_lines(self, line):
+        """Return the number of display lines of line."""
+        if self.layout[2] == 'none':
+            return 1
+        if len(self.counts) < line:
+            self.counts += [None] * (line - len(self.counts))
+        if self.counts[line - 1] is None:
+            count = self.text.count('{}.0'.format(line),
+                '{}.0'.format(line + 1), 'displaylines')
+            self.counts[line - 1] = count[0] if count and count[0] else 1
+        return self.counts[line - 1]
+
+    def draw(self):
+        """Update the line numbers for the current view of the text
+        widget."""
+        text = self.text
+        # the height changes the number of visible lines
+        layout = (text.winfo_width(), text.winfo_height(),
+            str(text.cget('wrap')))
+        if layout != self.layout:
+            self.layout = layout
+            self.counts = []
+            self.view = None
+        line, col = [int(x) for x in text.index('@0,0').split('.')]
+        if col > 0:
+            # the start of the line is above the view
+            line += 1
+        nb_lines = int(text.index('end-1c').split('.')[0])
+        info = text.dlineinfo('{}.0'.format(line))
+        view = line, info and info[1], nb_lines
+        if view == self.view:
+            return
+        self.view = view
+        canvas = self.canvas
+        if len(str(nb_lines)) != self.nb_chars:
+            self.nb_chars = len(str(nb_lines))
+            char_width = self.font.measure('0')
+            canvas['width'] = (self.nb_chars + 2) * char_width
+            self.x = (self.nb_chars + 1) * char_width
+            canvas.delete('all')
+            self.items = {}
+        # y of the visible lines
+        wanted = {}
+        if info is not None:
+            y, height = info[1], info[3]
+            bottom = text.winfo_height()
+            while line <= nb_lines and y < bottom:
+                wanted[line] = y
+                y += self.display_lines(line) * height
+                line += 1
+        shifts = set(wanted[line] - y for line, (item, y)
+            in self.items.items() if line in wanted)
+        if len(shifts) == 1 and 0 not in shifts:
+            # the view was scrolled : move all the items
+            shift = shifts.pop()
+            canvas.move('all', 0, shift)
+            self.items = {line: (item, y + shift)
+                for line, (item, y) in self.items.items()}
+        free = [item for line, (item, y) in self.items.items()
+            if line not in wanted]
+        items = {}
+        for line, y in wanted.items():
+            item, old_y = self.items.get(line, (None, None))
+            if item is None:
+                if free:
+                    item = free.pop()
+                    canvas.coords(item, self.x, y)
+                    canvas.itemconfigure(item, text=str(line))
+                else:
+                    item = canvas.create_text(self.x, y, anchor='ne',
+                        text=str(line), font=self.font, fill=self.fg)
+            elif y != old_y:
+                canvas.coords(item, self.x, y)
+            items[line] = (item, y)
+        for item in free:
+            canvas.delete(item)
+        self.items = items
+
+    def edited(self, first, old_last, new_last):
+        """Lines first to old_last were replaced by lines first to
+        new_last."""
+        self.counts[first - 1:old_last] = [None] * (new_last - first + 1)
+        self.view = None
+
+    def invalidate(self):
+        """Called when the font changed."""
+        self.layout = None
+        self.nb_chars = 0
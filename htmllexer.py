@@ -0,0 +1,110 @@
+"""Lexer for HTML documents.
+
+The document is read in one pass with str.find() and a few regular
+expressions, without building a tree of elements. The result is the list of
+the highlighted spans (start, end, tag) and the list of the scripts, with
+offsets in the text.
+The lexer never fails on malformed HTML : a tag that is not closed ends at
+the next <, a comment that is not closed runs to the end of the text, and
+the content of a <script> or <style> element without an end tag is lexed as
+HTML. The rest of the document is highlighted as usual.
+"""
+
+import re
+
+# name of a start or end tag
+tag_name = re.compile(r'</?([A-Za-z][^\s/<>]*)')
+# attributes of a start tag, up to the > ; a quoted value may include >
+# but not <, so that a quote that is not closed doesn't extend the tag to the
+# rest of the document
+attributes = re.compile(r'''(?:[^<>=]+|=\s*"[^"<]*"|=\s*'[^'<]*'|=)*''')
+# name and value of an attribute
+attribute = re.compile(
+    r'''([^\s/>"'=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]*))?''')
+# elements whose content is not HTML : regular expression for the end tag
+raw_text = {'script': re.compile('</script', re.I),
+    'style': re.compile('</style', re.I)}
+
+
+def script_lang(attrs, script_langs):
+    """Return the language of a <script> tag with attributes attrs, None if
+    it has a src attribute or if its type is not in script_langs."""
+    lang = script_langs.get('text/javascript')
+    for mo in attribute.finditer(attrs):
+        key, value = mo.group(1).lower(), mo.group(2) or ''
+        if value and value[0] in '"\'':
+            value = value[1:-1]
+        if key == 'src':
+            return None
+        elif key == 'type':
+            lang = script_langs.get(value)
+    return lang
+
+
+def tag_end(txt, pos):
+    """Return the end of a tag whose > is after pos ; if the tag is not
+    closed, it ends at the next <."""
+    end = txt.find('>', pos)
+    lt = txt.find('<', pos)
+    if lt > -1 and (end == -1 or lt < end):
+        return lt
+    return len(txt) if end == -1 else end + 1
+
+
+def tokenize(txt, script_langs):
+    """Lex the HTML document txt. script_langs maps the script types (eg
+    "text/python") to a language name.
+    Return the spans (start, end, tag) of the HTML syntax, and the list of
+    the scripts in a language of script_langs as (lang, tag start, begin,
+    end) : tag start is the offset of the <script> tag, begin and end are
+    the offsets of the script."""
+    spans = []
+    scripts = []
+    length = len(txt)
+    pos = 0
+    while True:
+        start = txt.find('<', pos)
+        if start == -1:
+            break
+        if txt.startswith('<!--', start):
+            end = txt.find('-->', start + 4)
+            pos = length if end == -1 else end + 3
+            spans.append((start, pos, 'comment'))
+            continue
+        if txt.startswith('<!', start) or txt.startswith('<?', start):
+            # declaration or processing instruction
+            pos = tag_end(txt, start + 2)
+            spans.append((start, pos, 'keyword'))
+            continue
+        mo = tag_name.match(txt, start)
+        if mo is None:
+            # a < in the text
+            pos = start + 1
+            continue
+        name_end = mo.end()
+        if txt[start + 1] == '/':
+            pos = tag_end(txt, name_end)
+            spans.append((start, pos, 'keyword'))
+            continue
+        pos = attributes.match(txt, name_end).end()
+        spans += [(start, name_end, 'keyword'),
+            (start, name_end, 'kw_start')]
+        if pos > name_end:
+            spans.append((name_end, pos, 'comment'))
+        if pos == length or txt[pos] != '>':
+            # the tag is not closed
+            continue
+        spans.append((pos, pos + 1, 'keyword'))
+        pos += 1
+        name = mo.group(1).lower()
+        if name in raw_text:
+            mo_end = raw_text[name].search(txt, pos)
+            if mo_end is None:
+                continue
+            if name == 'script':
+                lang = script_lang(txt[name_end:pos - 1], script_langs)
+                if lang is not None:
+                    begin = pos + 1 if txt.startswith('\n', pos) else pos
+                    scripts.append((lang, start, begin, mo_end.start()))
+            pos = mo_end.start()
+    return spans, scripts
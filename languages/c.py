@@ -1,5 +1,5 @@
 extensions = ['.c', '.h']
-script_types = ['text/javascript']
+script_types = []
 struct_patterns = [r'^[a-zA-Z0-9_]+\(.*', '#define .*']
 keywords = [
     'auto',    'break',    'case',    'char',    'const',    'continue',    'default',    'do',
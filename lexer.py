@@ -0,0 +1,163 @@
+"""Tokenizer for the languages defined in the package languages.
+
+A Lexer finds the strings, comments, keywords, builtins and brackets of a
+text, with regular expressions compiled once for the language. It doesn't
+use Tk, the Tk indices are computed by the editor.
+"""
+
+import re
+
+# tags for the brackets, the same in all languages
+bracket_tags = {'[': 'square_bracket', ']': 'square_bracket',
+    '(': 'parenthesis', ')': 'parenthesis',
+    '{': 'curly_brace', '}': 'curly_brace'}
+
+
+def words_pattern(words):
+    """Return a regular expression that matches the words in the list. The
+    alternatives are grouped by common prefixes, so that the regular
+    expression engine doesn't try all the words at each position."""
+    tree = {}
+    for word in words:
+        node = tree
+        for car in word:
+            node = node.setdefault(car, {})
+        node[''] = {}
+
+    def branches(node):
+        alternatives = [re.escape(car) + branches(child)
+            for car, child in sorted(node.items()) if car]
+        if not alternatives:
+            return ''
+        if len(alternatives) == 1 and '' not in node:
+            return alternatives[0]
+        pattern = '(?:' + '|'.join(alternatives) + ')'
+        return pattern + '?' if '' in node else pattern
+
+    first = ''.join(re.escape(car) for car in sorted(tree))
+    return r'\b(?=[{}]){}\b'.format(first, branches(tree))
+
+
+class Lexer:
+
+    def __init__(self, language):
+        # zones are (start, stop, tag) for strings and comments ; sort them
+        # with longest delimiters first : if """ matches, don't try a single "
+        self.zones = sorted(language.zones, key=lambda x: len(x[0]),
+            reverse=True)
+        self.zone_nums = {}
+        for num, (start, stop, tag) in enumerate(self.zones):
+            self.zone_nums.setdefault(start, num)
+        self.openers = None
+        if self.zones:
+            self.openers = re.compile('|'.join(re.escape(start)
+                for start, stop, tag in self.zones))
+        # tags of keywords and builtins ; names in both lists (True,
+        # None...) get both tags
+        self.word_tags = dict.fromkeys(language.keywords, 'keyword')
+        self.word_tags.update(dict.fromkeys(language.builtins, 'builtin'))
+        self.builtin_keywords = set(language.keywords) & set(
+            language.builtins)
+        self.words = None
+        if self.word_tags:
+            self.words = re.compile(words_pattern(self.word_tags))
+
+    def tokenize(self, txt, state=None):
+        """Return (spans, states). spans is the list of (start, end, tag) of
+        the tokens in txt. states is the list of the lexer states at the
+        start of each line after the first one.
+        A lexer state is None, or the index in self.zones of the string or
+        comment that goes on at the start of the line. The argument state
+        is the lexer state at the start of txt."""
+        spans = []
+        # zones with line feeds inside : (start, end, num)
+        multiline = []
+        # pieces of txt with strings and comments replaced by spaces, so that
+        # keywords and brackets are searched in the code only
+        code = []
+        pos = 0
+        if state is not None:
+            pos = self.zone_end(txt, state, 0)
+            self.add_zone(txt, spans, multiline, state, 0, pos)
+            code.append(' ' * (len(txt) if pos == -1 else pos))
+        search = self.openers.search if self.openers else None
+        zone_nums, zones = self.zone_nums, self.zones
+        while pos > -1:
+            mo = search(txt, pos) if search else None
+            if mo is None:
+                code.append(txt[pos:])
+                break
+            start, end = mo.span()
+            num = zone_nums[mo.group()]
+            stop = zones[num][1]
+            # usual case : the first stop delimiter is not escaped
+            found = txt.find(stop, end)
+            if found > end and txt[found - 1] == '\\' or found == -1:
+                end = self.zone_end(txt, num, end)
+            else:
+                end = found + len(stop)
+            if end > -1 and txt.find('\n', start, end - 1) == -1:
+                spans.append((start, end, zones[num][2]))
+            else:
+                self.add_zone(txt, spans, multiline, num, start, end)
+            code.append(txt[pos:start])
+            code.append(' ' * ((len(txt) if end == -1 else end) - start))
+            pos = end
+        code = ''.join(code)
+        if self.words:
+            word_tags = self.word_tags
+            words = list(self.words.finditer(code))
+            spans += [mo.span() + (word_tags[mo.group()],) for mo in words]
+            if self.builtin_keywords:
+                both = self.builtin_keywords
+                spans += [mo.span() + ('keyword',) for mo in words
+                    if mo.group() in both]
+        # brackets are single characters, str.find is faster than a regular
+        # expression
+        for car, tag in bracket_tags.items():
+            pos = code.find(car)
+            while pos > -1:
+                spans.append((pos, pos + 1, tag))
+                pos = code.find(car, pos + 1)
+        # compute the lexer states at line starts
+        states = [None] * txt.count('\n')
+        line, counted = 0, 0
+        for start, end, num in multiline:
+            line += txt.count('\n', counted, start)
+            counted = start
+            nb = txt.count('\n', start, end)
+            states[line:line + nb] = [num] * nb
+        return spans, states
+
+    def add_zone(self, txt, spans, multiline, num, start, end):
+        """Add the string or comment of type num between start and end (-1
+        if it doesn't end in txt) to spans, and to multiline if the next
+        lines start inside it."""
+        if end == -1:
+            # goes on after the end of txt
+            spans.append((start, len(txt), self.zones[num][2]))
+            multiline.append((start, len(txt), num))
+        else:
+            spans.append((start, end, self.zones[num][2]))
+            # a line feed at the end of a comment doesn't start a line
+            # inside it
+            if txt.find('\n', start, end - 1) > -1:
+                multiline.append((start, end - 1, num))
+
+    def zone_end(self, txt, num, pos):
+        """Return the position after the end of the zone num (string or
+        comment) whose content starts at pos, or -1 if it doesn't end in txt.
+        A stop delimiter preceded by an odd number of backslashes doesn't end
+        the zone."""
+        stop = self.zones[num][1]
+        start = pos
+        while True:
+            end = txt.find(stop, pos)
+            if end == -1:
+                return -1
+            escape = end
+            while escape > start and txt[escape - 1] == '\\':
+                escape -= 1
+            if (end - escape) % 2 == 0:
+                return end + len(stop)
+            pos = end + 1
@@ -0,0 +1,50 @@
+"""Conversion between offsets in a text and Tk indices "line.col".
+
+A LineIndex stores the offsets of the line starts in an array of integers,
+instead of a (line, col) tuple per character : an offset is converted by
+a binary search in the array.
+"""
+
+from array import array
+from bisect import bisect_right
+
+
+class LineIndex:
+
+    def __init__(self, txt, line=1, col=0):
+        # txt starts at line, col in the widget
+        self.line, self.col = line, col
+        self.length = len(txt)
+        self.starts = array('l', [0])
+        pos = txt.find('\n')
+        while pos > -1:
+            self.starts.append(pos + 1)
+            pos = txt.find('\n', pos + 1)
+
+    def __len__(self):
+        """Number of lines in the text."""
+        return len(self.starts)
+
+    def index(self, offset):
+        """Return the Tk index of offset."""
+        return '{}.{}'.format(*self.pos(offset))
+
+    def line_num(self, offset):
+        """Return the number of the line of offset in the text (0 for the
+        first line)."""
+        return bisect_right(self.starts, offset) - 1
+
+    def offset(self, line, col):
+        """Return the offset of the position line, col of the widget."""
+        line -= self.line
+        if line == 0:
+            col -= self.col
+        return self.starts[line] + col
+
+    def pos(self, offset):
+        """Return the position (line, col) of offset in the widget."""
+        num = bisect_right(self.starts, offset) - 1
+        col = offset - self.starts[num]
+        if num == 0:
+            col += self.col
+        return self.line + num, col
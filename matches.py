@@ -0,0 +1,116 @@
+"""Matches of a regular expression in a document.
+
+The matches are found by a single call to finditer() on the searched text,
+and their offsets are kept in sorted arrays : the match after or before a
+position is found by a binary search, without searching the text again.
+The matches are found again only when the pattern, the searched range or
+the document change.
+Empty matches are ignored.
+The regular expressions entered by the user are run in a worker process
+(see sandbox.py), so that a pattern that takes too long can be stopped.
+"""
+
+from array import array
+from bisect import bisect_left
+
+import lineindex
+import sandbox
+
+
+def find_spans(regex, txt):
+    """Return the arrays of the start and end offsets of the matches of
+    regex in txt."""
+    starts, ends = array('l'), array('l')
+    for mo in regex.finditer(txt):
+        if mo.end() > mo.start():
+            starts.append(mo.start())
+            ends.append(mo.end())
+    return starts, ends
+
+
+def substitute(regex, replacement, txt):
+    """Replace the matches of regex in txt by replacement, with the syntax
+    of re.sub(). Return the result, the number of matches, the start of the
+    first match and the end of the last one."""
+    spans = []
+    def expand(mo):
+        spans.append(mo.span())
+        return mo.expand(replacement)
+    result, found = regex.subn(expand, txt)
+    if not found:
+        return result, 0, None, None
+    return result, found, spans[0][0], spans[-1][1]
+
+
+class MatchList:
+
+    def __init__(self):
+        # pattern, searched range and document of the matches
+        self.key = None
+        # start and end offsets of the matches
+        self.starts = array('l')
+        self.ends = array('l')
+        self.lines = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def between(self, first, last):
+        """Return the Tk indices of the start and end of the matches that
+        start in lines first to last."""
+        ixs = []
+        num = bisect_left(self.starts, self.offset(first, 0))
+        stop = bisect_left(self.starts, self.offset(last + 1, 0))
+        for num in range(num, stop):
+            ixs += self.span(num)
+        return ixs
+
+    def find(self, key, regex, txt, line, col, sandboxed=False):
+        """Find the matches of regex in txt, the text that starts at position
+        line, col of the document. If key is the same as for the previous
+        call, the matches are still valid and are not searched again.
+        If sandboxed is set, the search is run in a worker process ; raise
+        TimeoutError if it takes too long."""
+        if key == self.key:
+            return
+        if sandboxed:
+            self.starts, self.ends = sandbox.call(find_spans, regex, txt)
+        else:
+            self.starts, self.ends = find_spans(regex, txt)
+        self.key = key
+        self.lines = lineindex.LineIndex(txt, line, col)
+
+    def next(self, line, col, wrap=True):
+        """Return the number of the first match that starts at or after
+        position line, col. If there is none, return 0 if wrap is set,
+        otherwise None."""
+        num = bisect_left(self.starts, self.offset(line, col))
+        if num < len(self.starts):
+            return num
+        if wrap and self.starts:
+            return 0
+
+    def offset(self, line, col):
+        """Return the offset of position line, col in the searched text ;
+        the positions outside of the text are bound to its start or end."""
+        lines = self.lines
+        if (line, col) < (lines.line, lines.col):
+            return 0
+        if line >= lines.line + len(lines):
+            return lines.length
+        return min(lines.offset(line, col), lines.length)
+
+    def previous(self, line, col, wrap=True):
+        """Return the number of the last match that starts before position
+        line, col. If there is none, return the last match if wrap is set,
+        otherwise None."""
+        num = bisect_left(self.starts, self.offset(line, col)) - 1
+        if num >= 0:
+            return num
+        if wrap and self.starts:
+            return len(self.starts) - 1
+
+    def span(self, num):
+        """Return the Tk indices of the start and end of match num."""
+        return (self.lines.index(self.starts[num]),
+            self.lines.index(self.ends[num]))
@@ -0,0 +1,70 @@
+"""Outline of a document : its functions, classes and methods.
+
+The outline is the list of the lines that match one of the struct_patterns
+of the language. The result is kept for each line ; when lines are edited,
+only these lines have to be matched again, the result of the other lines
+is kept even if they are shifted.
+"""
+
+import re
+
+# struct_patterns of a language -> regular expression matching one of them
+regexes = {}
+
+
+def get_regex(patterns):
+    key = tuple(patterns)
+    if key not in regexes:
+        regexes[key] = re.compile('|'.join('(?:{})'.format(pattern)
+            for pattern in patterns))
+    return regexes[key]
+
+
+class Outline:
+
+    def __init__(self):
+        self.lang = None
+        # for each line : its label if it is in the outline, False if it is
+        # not, None if unknown
+        self.lines = []
+
+    def edited(self, first, old_last, new_last):
+        """Lines first to old_last were replaced by lines first to
+        new_last."""
+        self.lines[first - 1:old_last] = [None] * (new_last - first + 1)
+
+    def targets(self, first, last):
+        """Return the list of (label, line number) of lines first to
+        last."""
+        return [(label, num) for num, label in enumerate(
+            self.lines[first - 1:last], start=first)
+            if isinstance(label, str)]
+
+    def unknown(self):
+        """Return the list of the ranges (first, last) of lines whose label is
+        unknown."""
+        ranges = []
+        for num, label in enumerate(self.lines, start=1):
+            if label is None:
+                if ranges and ranges[-1][1] == num - 1:
+                    ranges[-1][1] = num
+                else:
+                    ranges.append([num, num])
+        return ranges
+
+    def update(self, lang, patterns, nb_lines, get_lines):
+        """Compute the labels of the lines that are unknown. get_lines(first,
+        last) returns the text of lines first to last."""
+        if lang != self.lang or len(self.lines) != nb_lines:
+            self.lang = lang
+            self.lines = [None] * nb_lines
+        regex = get_regex(patterns)
+        for first, last in self.unknown():
+            lines = get_lines(first, last).split('\n')
+            for num, line in enumerate(lines[:last - first + 1],
+                    start=first - 1):
+                line = line.rstrip()
+                if regex.search(line):
+                    self.lines[num] = line[:line.find('(')]
+                else:
+                    self.lines[num] = False
@@ -0,0 +1,123 @@
+"""Apply highlighting tags to a text widget, line by line.
+
+A Renderer keeps the tokens currently applied on each line of the widget.
+When a range of lines is highlighted again, only the tokens that changed
+are sent to Tk, with one "tag add" or "tag remove" command per tag name
+for all the changed tokens.
+A token is a tuple (start, end, tag) where start and end are columns in the
+line ; end is None if the token includes the line feed at the end of the
+line (strings and comments on several lines).
+"""
+
+
+def split_lines(spans, line_index):
+    """Return the list of the tokens of each line, for the spans (start,
+    end, tag) in a text. line_index is the lineindex.LineIndex of the
+    text."""
+    starts, col = line_index.starts, line_index.col
+    line_num = line_index.line_num
+    lines = [[] for start in starts]
+    for k1, k2, tag in spans:
+        if k2 <= k1:
+            continue
+        l1 = line_num(k1)
+        l2 = line_num(k2 - 1)
+        if l2 + 1 < len(starts) and starts[l2 + 1] == k2:
+            # the token ends with the line feed of line l2
+            end = None
+        else:
+            end = k2 - starts[l2]
+        c1 = k1 - starts[l1]
+        if l1 == 0:
+            c1 += col
+        if l1 == l2:
+            if l1 == 0 and end is not None:
+                end += col
+            lines[l1].append((c1, end, tag))
+            continue
+        lines[l1].append((c1, None, tag))
+        for line in range(l1 + 1, l2):
+            lines[line].append((0, None, tag))
+        lines[l2].append((0, end, tag))
+    return lines
+
+
+def mark_too_long(tokens, lines, first=0, last=None):
+    """Add a token for the part that exceeds 80 characters in the lines
+    tokens[first:last]. lines is the lineindex.LineIndex of the text."""
+    last = len(tokens) if last is None else last
+    starts = lines.starts
+    for line in range(first, last):
+        length = starts[line + 1] - starts[line] - 1
+        if length > 78:
+            tokens[line].append((78, length, 'too_long'))
+
+
+class Renderer:
+
+    def __init__(self, call, tags):
+        # call runs a command of the text widget, eg call('tag', 'add', ...)
+        self.call = call
+        # the tags managed by the renderer
+        self.tags = tags
+        # tokens applied on each line, None if they are unknown (the line
+        # was edited since it was rendered)
+        self.lines = [None]
+
+    def clear(self, nb_lines):
+        """Called when all the tags were removed from the widget."""
+        self.lines = [[]] * nb_lines
+
+    def edited(self, first, old_last, new_last):
+        """Lines first to old_last were replaced by lines first to
+        new_last : the tokens on these lines are unknown."""
+        self.lines[first - 1:old_last] = [None] * (new_last - first + 1)
+
+    def render(self, first, tokens):
+        """tokens is the list of the tokens of lines first, first + 1, etc.
+        Update the tags of these lines in the widget."""
+        if len(self.lines) < first - 1 + len(tokens):
+            self.lines += [None] * (first - 1 + len(tokens) -
+                len(self.lines))
+        added = {}
+        removed = {}
+        # ranges of lines whose tokens are unknown : all the tags are removed
+        unknown = []
+        for num, new in enumerate(tokens, start=first):
+            old = self.lines[num - 1]
+            if new == old:
+                continue
+            self.lines[num - 1] = new
+            if old is None:
+                if unknown and unknown[-1][1] == num:
+                    unknown[-1][1] = num + 1
+                else:
+                    unknown.append([num, num + 1])
+                old = ()
+            else:
+                old = set(old)
+                for token in old.difference(new):
+                    removed.setdefault(token[2], []).extend(
+                        self.indices(num, token))
+            for token in new:
+                if token not in old:
+                    added.setdefault(token[2], []).extend(
+                        self.indices(num, token))
+        if unknown:
+            indices = []
+            for start, stop in unknown:
+                indices += ['{}.0'.format(start), '{}.0'.format(stop)]
+            for tag in self.tags:
+                removed.setdefault(tag, []).extend(indices)
+        for tag, indices in removed.items():
+            self.call('tag', 'remove', tag, *indices)
+        for tag, indices in added.items():
+            self.call('tag', 'add', tag, *indices)
+
+    def indices(self, num, token):
+        """Return the Tk indices of the start and end of token in line
+        num."""
+        start, end, tag = token
+        if end is None:
+            return ['{}.{}'.format(num, start), '{}.0'.format(num + 1)]
+        return ['{}.{}'.format(num, start), '{}.{}'.format(num, end)]
@@ -0,0 +1,87 @@
+"""Regular expressions run in a worker process, with a time limit.
+
+A regular expression entered by the user can take a time that grows
+exponentially with the length of the text. It is run in a process that is
+killed if it doesn't answer in time : the editor reports that the search
+took too long instead of freezing.
+The processes are kept between searches : call() uses a free process, or
+starts a new one.
+"""
+
+import multiprocessing
+import threading
+
+import workers
+
+# seconds given to a regular expression on a document or a file
+time_limit = 5
+
+# processes that are not running a function
+free = []
+lock = threading.Lock()
+
+
+def call(func, *args):
+    """Return func(*args), run in a worker process. func must be a function
+    defined at the top level of a module. Raise TimeoutError if it takes
+    more than time_limit seconds, or if the process dies before it answers
+    (for instance if the regular expression takes all the memory)."""
+    with lock:
+        sandbox = free.pop() if free else Sandbox()
+    try:
+        return sandbox.call(func, args, time_limit)
+    finally:
+        with lock:
+            free.append(sandbox)
+
+
+def serve(conn):
+    """Run in the worker process : run the functions received from conn and
+    send back their result."""
+    while True:
+        try:
+            func, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, func(*args)))
+        except Exception as exc:
+            conn.send((False, exc))
+
+
+class Sandbox:
+    """A worker process."""
+
+    def __init__(self):
+        self.process = None
+        self.conn = None
+
+    def call(self, func, args, timeout):
+        if self.process is None:
+            context = multiprocessing.get_context('spawn')
+            self.conn, child_conn = context.Pipe()
+            self.process = context.Process(target=serve, args=(child_conn,),
+                daemon=True)
+            workers.spawning(self.process.start)
+            child_conn.close()
+        try:
+            self.conn.send((func, args))
+            answered = self.conn.poll(timeout)
+            if answered:
+                ok, result = self.conn.recv()
+        except (EOFError, OSError):
+            # the process died : a new one is started at the next call
+            answered = False
+        if not answered:
+            self.kill()
+            raise TimeoutError
+        if not ok:
+            raise result
+        return result
+
+    def kill(self):
+        """Kill the process, a new one is started at the next call."""
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.process = self.conn = None
@@ -0,0 +1,44 @@
+"""Deferred jobs of an editor.
+
+The work done after a keystroke (syntax highlighting, brace matching, line
+numbers, modification marker) is not run in the key binding : it is
+scheduled as a named job. Scheduling a job that is already pending cancels
+the previous timer, so that a job runs at most once however many keys were
+pressed in the meantime.
+"""
+
+
+class Scheduler:
+
+    def __init__(self, widget):
+        # the Tk widget whose after() methods are used
+        self.widget = widget
+        # pending jobs : name -> (callback, timer id)
+        self.jobs = {}
+
+    def cancel(self, name):
+        """Cancel the job name if it is pending."""
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            self.widget.after_cancel(job[1])
+
+    def cancel_all(self):
+        for name in list(self.jobs):
+            self.cancel(name)
+
+    def pending(self, name):
+        return name in self.jobs
+
+    def run(self, name):
+        callback, timer = self.jobs.pop(name)
+        callback()
+
+    def schedule(self, name, callback, delay=None):
+        """Run callback after delay milliseconds, or when Tk is idle if delay
+        is None. A pending job with the same name is cancelled."""
+        self.cancel(name)
+        if delay is None:
+            timer = self.widget.after_idle(self.run, name)
+        else:
+            timer = self.widget.after(delay, self.run, name)
+        self.jobs[name] = (callback, timer)
@@ -0,0 +1,83 @@
+"""Index of the <script> regions of an HTML document.
+
+The regions found when the document is parsed are kept in a list sorted by
+position : the region at a position is found by a binary search. When the
+document is edited the positions are shifted ; the document has to be
+parsed again only if the edit may change the regions, that is if it is in
+a <script> tag, or if the inserted or deleted text outside of the scripts
+has one of the characters < > " ' =, or if the edited lines have the word
+"script".
+"""
+
+from bisect import bisect_right
+
+
+def shift(pos, old_end, new_end):
+    """Return the new position of pos, after the edit that replaced the
+    text up to old_end by the text up to new_end ; pos is after old_end."""
+    if pos[0] == old_end[0]:
+        return new_end[0], new_end[1] + pos[1] - old_end[1]
+    return pos[0] + new_end[0] - old_end[0], pos[1]
+
+
+class ScriptIndex:
+
+    def __init__(self):
+        # (begin, end, lang, tag start) of each region, sorted by position ;
+        # positions are (line, col) tuples
+        self.regions = []
+        # start of each region, for the binary search
+        self.begins = []
+        # False if the document must be parsed again
+        self.valid = False
+
+    def edited(self, start, old_end, new_end, changed, lines):
+        """Update the regions after the edit that replaced the text between
+        positions start and old_end by the text between start and new_end.
+        changed is the character before the edit, the deleted text and the
+        inserted text ; lines is the text of the edited lines before and
+        after the edit."""
+        if not self.valid:
+            return
+        if 'script' in lines.lower():
+            self.valid = False
+            return
+        markup = any(car in changed for car in '<>"\'=')
+        for begin, end, lang, tag_start in self.regions:
+            if start <= end and tag_start <= old_end:
+                if begin < start and old_end < end and '</' not in changed:
+                    # the edit is inside the script
+                    markup = False
+                else:
+                    # the edit is in a <script> tag
+                    markup = True
+                break
+        if markup:
+            # the edit may add or remove a tag
+            self.valid = False
+            return
+        regions = []
+        for begin, end, lang, tag_start in self.regions:
+            if tag_start >= old_end:
+                tag_start = shift(tag_start, old_end, new_end)
+                begin = shift(begin, old_end, new_end)
+            if end >= old_end:
+                end = shift(end, old_end, new_end)
+            regions.append((begin, end, lang, tag_start))
+        self.regions = regions
+        self.begins = [region[0] for region in regions]
+
+    def find(self, pos):
+        """Return (lang, begin, end) for the region at position pos, or None
+        if pos is not in a region."""
+        i = bisect_right(self.begins, pos) - 1
+        if i >= 0 and pos <= self.regions[i][1]:
+            begin, end, lang, tag_start = self.regions[i]
+            return lang, begin, end
+
+    def set(self, regions):
+        """Set the regions (begin, end, lang, tag start) found by parsing
+        the document."""
+        self.regions = sorted(regions)
+        self.begins = [region[0] for region in self.regions]
+        self.valid = True
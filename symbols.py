@@ -0,0 +1,179 @@
+"""Index of the definitions in the files of a directory.
+
+The definitions are the lines that match one of the struct_patterns of the
+language of a file, as in the outline of a document (see outline.py). The
+name of a definition is its last identifier before the first parenthesis
+that is not a keyword of the language. The index maps each name to the
+files and lines where it is defined : right-click on an identifier offers
+the definitions found in the other files.
+The index is saved in the cache directory as JSON, with the modification
+time and size of each file. It is updated in a thread, at most every
+update_interval seconds : only the files that changed since they were
+indexed are read again, by a pool of processes if there are many of them.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+import fileformat
+import filesearch
+import outline
+import walker
+import workers
+
+# format of the saved indices
+version = 1
+
+# directory -> SymbolIndex
+indices = {}
+
+# minimum number of seconds between the starts of two updates of an index
+update_interval = 60
+# minimum number of changed files read by a pool of processes
+pool_min_files = 100
+
+identifier = re.compile(r'[^\W\d]\w*')
+
+
+def definitions(path, patterns, keywords, size_limit):
+    """Return the list of (name, line number, label) of the definitions in
+    file path, None if it can't be read. Files larger than size_limit have
+    no definitions."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(size_limit + 1)
+    except OSError:
+        return None
+    if len(data) > size_limit or filesearch.is_binary(data):
+        return []
+    try:
+        txt = data.decode(fileformat.file_encoding(path, data) or 'utf-8',
+            errors='replace')
+    except LookupError:
+        txt = data.decode('utf-8', errors='replace')
+    regex = outline.get_regex(patterns)
+    keywords = set(keywords)
+    result = []
+    for num, line in enumerate(txt.split('\n'), start=1):
+        if regex.search(line):
+            names = [name for name in identifier.findall(line.split('(')[0])
+                if name not in keywords]
+            if names:
+                result.append((names[-1], num, line.strip()))
+    return result
+
+
+def get(root, cache_dir):
+    """Return the index of directory root, saved in cache_dir."""
+    if root not in indices:
+        name = hashlib.md5(root.encode('utf-8')).hexdigest()
+        indices[root] = SymbolIndex(root,
+            os.path.join(cache_dir, name + '.symbols.json'))
+        indices[root].load()
+    return indices[root]
+
+
+class SymbolIndex:
+
+    def __init__(self, root, path):
+        self.root = root
+        # file where the index is saved
+        self.path = path
+        # path -> [modification time, size, definitions] of the indexed
+        # files
+        self.files = {}
+        # name -> list of (path, line number, label), built from self.files
+        # at the first lookup
+        self.names = None
+        self.lock = threading.Lock()
+        self.thread = None
+        # time of the start of the last update
+        self.started = None
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == version and data.get('root') == self.root:
+            self.files = data['files']
+
+    def lookup(self, name):
+        """Return the list of (path, line number, label) of the definitions
+        of name."""
+        with self.lock:
+            if self.names is None:
+                self.names = {}
+                for path, (mtime, size, defs) in self.files.items():
+                    for def_name, num, label in defs:
+                        self.names.setdefault(def_name, []).append(
+                            (path, num, label))
+            return self.names.get(name, [])
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            data = json.dumps({'version': version, 'root': self.root,
+                'files': self.files})
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+    def start_update(self, languages):
+        """Update the index in a thread, unless an update is running or
+        started less than update_interval seconds ago."""
+        if self.thread is not None and (self.thread.is_alive() or
+                time.time() - self.started < update_interval):
+            return
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.update,
+            args=(languages,), daemon=True)
+        self.thread.start()
+
+    def update(self, languages):
+        """Index the files that were added or modified since the last
+        update, then save the index. languages maps the extensions of the
+        indexed files to the struct_patterns and keywords of their
+        language."""
+        stats = {}
+        for path in walker.walk(self.root, list(languages)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = [stat.st_mtime_ns, stat.st_size]
+        changed = [path for path, stat in stats.items()
+            if self.files.get(path, [None, None])[:2] != stat]
+        args = [languages[os.path.splitext(path)[1]] for path in changed]
+        patterns = [patterns for patterns, keywords in args]
+        keywords = [keywords for patterns, keywords in args]
+        # the worker processes don't have the configured size limit
+        size_limits = [filesearch.max_size] * len(changed)
+        if len(changed) < pool_min_files:
+            results = list(map(definitions, changed, patterns, keywords,
+                size_limits))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    mp_context=multiprocessing.get_context('spawn')) \
+                    as executor:
+                # the processes are started by map()
+                results = list(workers.spawning(lambda: executor.map(
+                    definitions, changed, patterns, keywords, size_limits,
+                    chunksize=16)))
+        found = {path: stats[path] + [defs]
+            for path, defs in zip(changed, results) if defs is not None}
+        removed = set(self.files) - set(stats)
+        if not found and not removed:
+            return
+        with self.lock:
+            for path in removed:
+                del self.files[path]
+            self.files.update(found)
+            self.names = None
+        self.save()
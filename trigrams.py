@@ -0,0 +1,254 @@
+"""Index of the trigrams of the files of a directory, for search in files.
+
+The index stores the trigrams (sequences of 3 bytes, with the ASCII letters
+in lower case) of each file, as the list of the numbers of the files that
+have each trigram. A file can only match a string if it has all the
+trigrams of the string : search in files doesn't read the other files,
+unless they were modified since they were indexed.
+The index is saved in the cache directory, read at the first use in the
+thread of a search or of an update, and updated in a thread : only the
+files whose size or modification time changed are read again. When a
+file is modified it gets a new number, the old one is removed from the
+index when there are too many of them.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+import threading
+from array import array
+
+import filesearch
+import walker
+
+# format of the saved indices
+version = 1
+
+# directory -> TrigramIndex
+indices = {}
+
+# number of characters of the argument of escapes
+escape_lengths = {'x': 2, 'u': 4, 'U': 8}
+
+
+def get(root, cache_dir):
+    """Return the index of directory root, saved in cache_dir. The saved
+    index is not read yet (see TrigramIndex.load)."""
+    if root not in indices:
+        name = hashlib.md5(root.encode('utf-8')).hexdigest()
+        indices[root] = TrigramIndex(root,
+            os.path.join(cache_dir, name + '.trigrams'))
+    return indices[root]
+
+
+def literals(pattern):
+    """Return strings that are in all the matches of the regular expression
+    pattern. Only the characters outside of the groups are considered, and
+    none if the pattern has alternatives or inline flags, such as (?x)
+    where the spaces are not literal."""
+    if '|' in pattern or re.search(r'\(\?[aiLmsux-]', pattern):
+        return []
+    result = []
+    run = ''
+    depth = 0
+    pos = 0
+    while pos < len(pattern):
+        car = pattern[pos]
+        pos += 1
+        if car == '\\':
+            car = pattern[pos:pos + 1]
+            pos += 1
+            if car.isalnum() or not car:
+                # character class, back reference, etc. : skip the
+                # argument of the escape
+                if car in escape_lengths:
+                    pos += escape_lengths[car]
+                elif car == 'N' and pattern.startswith('{', pos):
+                    pos = pattern.find('}', pos) + 1 or len(pattern)
+                elif car.isdigit():
+                    # octal escape or number of a group
+                    while pos < len(pattern) and pattern[pos].isdigit():
+                        pos += 1
+                result.append(run)
+                run = ''
+                continue
+        elif car in '*?{':
+            # the previous character is optional
+            result.append(run[:-1])
+            run = ''
+            if car == '{':
+                pos = pattern.find('}', pos) + 1 or len(pattern)
+            continue
+        elif car in '.^$+()[':
+            result.append(run)
+            run = ''
+            if car == '(':
+                depth += 1
+            elif car == ')':
+                depth -= 1
+            elif car == '[':
+                # skip the set, where ] can be the first character
+                pos += 2 if pattern.startswith('^]', pos) else \
+                    1 if pattern.startswith(']', pos) else 0
+                while pos < len(pattern) and pattern[pos] != ']':
+                    pos += 2 if pattern[pos] == '\\' else 1
+                pos += 1
+            continue
+        if depth == 0:
+            run += car
+    result.append(run)
+    return [run for run in result if len(run) >= 3]
+
+
+def trigrams(data):
+    """Return the set of the trigrams of data (bytes)."""
+    data = data.lower()
+    return {data[pos:pos + 3] for pos in range(len(data) - 2)}
+
+
+class TrigramIndex:
+
+    def __init__(self, root, path):
+        self.root = root
+        # file where the index is saved
+        self.path = path
+        # path -> (number, modification time, size) of the indexed files
+        self.files = {}
+        # trigram -> numbers of the files that have it, in increasing order
+        self.postings = {}
+        self.next_num = 0
+        # numbers of the files that were modified or removed
+        self.nb_dead = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        # set when the saved index was read
+        self.loaded = False
+
+    def add(self, path, stat, data):
+        """Index the content data of the file path."""
+        with self.lock:
+            self.remove(path)
+            num = self.next_num
+            self.next_num += 1
+            self.files[path] = (num, stat.st_mtime_ns, stat.st_size)
+            postings = self.postings
+            for trigram in trigrams(data):
+                if trigram not in postings:
+                    postings[trigram] = array('l')
+                postings[trigram].append(num)
+
+    def compact(self):
+        """Renumber the files to remove the numbers of the files that were
+        modified or removed."""
+        with self.lock:
+            numbers = {}
+            for num, (path, (old, mtime, size)) in enumerate(
+                    sorted(self.files.items(), key=lambda item: item[1])):
+                numbers[old] = num
+                self.files[path] = (num, mtime, size)
+            self.postings = {trigram: array('l', [numbers[num]
+                    for num in nums if num in numbers])
+                for trigram, nums in self.postings.items()}
+            self.postings = {trigram: nums
+                for trigram, nums in self.postings.items() if nums}
+            self.next_num = len(self.files)
+            self.nb_dead = 0
+
+    def load(self):
+        """Read the saved index, if it was not read yet. Called in the
+        threads that use the index, not to block the editor."""
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            try:
+                with open(self.path, 'rb') as f:
+                    data = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                return
+            if data.get('version') == version and \
+                    data.get('root') == self.root:
+                self.files = data['files']
+                self.postings = data['postings']
+                self.next_num = data['next_num']
+                self.nb_dead = data['nb_dead']
+
+    def remove(self, path):
+        if path in self.files:
+            del self.files[path]
+            self.nb_dead += 1
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            data = pickle.dumps({'version': version, 'root': self.root,
+                'files': self.files, 'postings': self.postings,
+                'next_num': self.next_num, 'nb_dead': self.nb_dead})
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def skipped(self, strings):
+        """Return the set of the files that can't have a match of any of
+        the strings (bytes), and were not modified since they were
+        indexed."""
+        self.load()
+        needed = set()
+        for string in strings:
+            needed |= trigrams(string)
+        if not needed:
+            return set()
+        with self.lock:
+            nums = sorted((self.postings.get(trigram, ())
+                for trigram in needed), key=len)
+            candidates = set(nums[0])
+            for others in nums[1:]:
+                candidates.intersection_update(others)
+            paths = [(path, mtime, size)
+                for path, (num, mtime, size) in self.files.items()
+                if num not in candidates]
+        result = set()
+        for path, mtime, size in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+                result.add(path)
+        return result
+
+    def start_update(self):
+        """Update the index in a thread, unless an update is running."""
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.update, daemon=True)
+            self.thread.start()
+
+    def update(self):
+        """Index the files that were added or modified since the last
+        update, then save the index."""
+        self.load()
+        paths = set(walker.walk(self.root, ()))
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                indexed = self.files.get(path)
+                if indexed is not None and indexed[1:] == (stat.st_mtime_ns,
+                        stat.st_size):
+                    continue
+                if stat.st_size > filesearch.max_size:
+                    # not searched : index it without trigrams
+                    self.add(path, stat, b'')
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                self.add(path, stat, b'' if filesearch.is_binary(data)
+                    else data)
+            except OSError:
+                with self.lock:
+                    self.remove(path)
+        with self.lock:
+            for path in set(self.files) - paths:
+                self.remove(path)
+        if self.nb_dead > len(self.files):
+            self.compact()
+        self.save()
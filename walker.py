@@ -0,0 +1,226 @@
+"""Walk of the files of a project directory, for search in files.
+
+The files and directories that match the rules of the .gitignore and
+.hgignore files, or the patterns set by set_exclude(), are not walked. The
+patterns of set_exclude() use the syntax of .gitignore, relative to the
+walked directory.
+The list of the entries of each directory is kept with the modification
+time of the directory : it is read again only if an entry was added,
+removed or renamed.
+"""
+
+import os
+import re
+
+# directory -> (modification time, names of the subdirectories, names of
+# the files)
+snapshots = {}
+# path of an ignore file -> (modification time, rules)
+ignore_files = {}
+# patterns set by set_exclude()
+exclude = []
+
+
+def glob_rule(pattern, base):
+    """Return the Rule for a line of a .gitignore file in directory base,
+    None for comments and blank lines."""
+    pattern = pattern.rstrip()
+    if not pattern or pattern.startswith('#'):
+        return None
+    negate = pattern.startswith('!')
+    if negate or pattern.startswith(('\\!', '\\#')):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+        return None
+    anchored = '/' in pattern
+    return Rule(re.compile(translate(pattern.lstrip('/'))), base, negate,
+        dir_only, anchored)
+
+
+def hg_rules(lines, base):
+    """Return the rules of a .hgignore file in directory base."""
+    rules = []
+    syntax = 'regexp'
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('syntax:'):
+            syntax = line[7:].strip()
+            continue
+        if line.startswith(('glob:', 're:', 'regexp:')):
+            prefix, line = line.split(':', 1)
+            kind = 'glob' if prefix == 'glob' else 'regexp'
+        else:
+            kind = 'glob' if syntax == 'glob' else 'regexp'
+        try:
+            if kind == 'glob':
+                # hg glob patterns match at any depth
+                regex = re.compile(r'(?:.*/)?' + translate(line) +
+                    r'(?:/.*)?')
+                rules.append(Rule(regex, base))
+            else:
+                rules.append(Rule(re.compile(line), base, search=True))
+        except re.error:
+            pass
+    return rules
+
+
+def ignored(path, name, is_dir, rules):
+    """Return True if the entry at path is ignored by the rules : the last
+    rule that matches wins."""
+    result = False
+    for rule in rules:
+        if rule.negate == result and rule.match(path, name, is_dir):
+            result = not rule.negate
+    return result
+
+
+def listdir(dirpath):
+    """Return the names of the subdirectories and of the files of
+    dirpath."""
+    mtime = os.stat(dirpath).st_mtime_ns
+    snapshot = snapshots.get(dirpath)
+    if snapshot is not None and snapshot[0] == mtime:
+        return snapshot[1:]
+    dirnames, filenames = [], []
+    with os.scandir(dirpath) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirnames.append(entry.name)
+                elif entry.is_file():
+                    filenames.append(entry.name)
+            except OSError:
+                pass
+    dirnames.sort()
+    filenames.sort()
+    snapshots[dirpath] = (mtime, dirnames, filenames)
+    return dirnames, filenames
+
+
+def read_rules(dirpath):
+    """Return the rules of the ignore files in directory dirpath."""
+    rules = []
+    for name in ('.gitignore', '.hgignore'):
+        path = os.path.join(dirpath, name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+        if path not in ignore_files or ignore_files[path][0] != mtime:
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                continue
+            if name == '.gitignore':
+                file_rules = [glob_rule(line, dirpath) for line in lines]
+            else:
+                file_rules = hg_rules(lines, dirpath)
+            ignore_files[path] = (mtime, [rule for rule in file_rules
+                if rule is not None])
+        rules += ignore_files[path][1]
+    return rules
+
+
+def set_exclude(patterns):
+    """Exclude the files and directories that match patterns, a list of
+    .gitignore patterns."""
+    exclude[:] = patterns
+
+
+def translate(pattern):
+    """Return the regular expression for a glob pattern, where * doesn't
+    match a / but ** does."""
+    result = ''
+    pos = 0
+    while pos < len(pattern):
+        car = pattern[pos]
+        pos += 1
+        if car == '*':
+            if pattern.startswith('*/', pos):
+                result += '(?:.*/)?'
+                pos += 2
+            elif pattern.startswith('*', pos):
+                result += '.*'
+                pos += 1
+            else:
+                result += '[^/]*'
+        elif car == '?':
+            result += '[^/]'
+        elif car == '[':
+            end = pattern.find(']', pos + 1)
+            if end == -1:
+                result += re.escape(car)
+            else:
+                chars = pattern[pos:end]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                result += '[' + chars.replace('\\', '\\\\') + ']'
+                pos = end + 1
+        elif car == '\\' and pos < len(pattern):
+            result += re.escape(pattern[pos])
+            pos += 1
+        else:
+            result += re.escape(car)
+    return result
+
+
+def walk(root, extensions):
+    """Return the paths of the files under root that are not ignored and
+    have one of the extensions (all the files if extensions is empty), in
+    the order of a walk with the names sorted in each directory."""
+    paths = []
+    rules = [rule for rule in (glob_rule(pattern, root)
+        for pattern in exclude) if rule is not None]
+    stack = [(root, rules)]
+    while stack:
+        dirpath, rules = stack.pop()
+        try:
+            dirnames, filenames = listdir(dirpath)
+        except OSError:
+            continue
+        rules = rules + read_rules(dirpath)
+        for fname in filenames:
+            if extensions and os.path.splitext(fname)[1] not in extensions:
+                continue
+            path = os.path.join(dirpath, fname)
+            if not ignored(path, fname, False, rules):
+                paths.append(path)
+        subdirs = []
+        for dirname in dirnames:
+            path = os.path.join(dirpath, dirname)
+            if not ignored(path, dirname, True, rules):
+                subdirs.append((path, rules))
+        # the first subdirectory is walked first
+        stack += reversed(subdirs)
+    return paths
+
+
+class Rule:
+    """Rule of an ignore file, for the paths under directory base."""
+
+    def __init__(self, regex, base, negate=False, dir_only=False,
+            anchored=True, search=False):
+        self.regex = regex
+        self.base = base
+        self.negate = negate
+        self.dir_only = dir_only
+        # if not anchored, the rule is for the names of the entries
+        self.anchored = anchored
+        # if search is set, the regular expression can match anywhere in
+        # the path (.hgignore syntax)
+        self.search = search
+
+    def match(self, path, name, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        if not self.anchored:
+            return self.regex.fullmatch(name) is not None
+        path = os.path.relpath(path, self.base).replace(os.sep, '/')
+        if self.search:
+            return self.regex.search(path) is not None
+        return self.regex.fullmatch(path) is not None
@@ -0,0 +1,214 @@
+"""Lexing in worker processes.
+
+Large documents, and the scripts of large HTML documents, can be lexed in a
+pool of processes : the main thread only applies the tags, and the editor
+stays responsive while a big file is lexed. The results are sent back as
+arrays of integers, which are much faster to transfer than lists of
+tuples.
+
+The pool is created at the first use, with the number of processes set by
+set_pool().
+"""
+
+import concurrent.futures
+import importlib
+import multiprocessing
+import sys
+import threading
+import types
+from array import array
+
+import lexer
+import lineindex
+import renderer
+
+# settings, see set_pool()
+max_workers = 0
+min_size = 0
+
+pool = None
+
+# number of calls of spawning() that are running, spec of __main__ before
+# the first one
+nb_spawning = 0
+main_spec = None
+spawning_lock = threading.Lock()
+
+# lexers of the worker process
+lexers = {}
+
+
+class LineTokens:
+    """The tokens of each line of a document, and the lexer states at the
+    start of the lines after the first one."""
+
+    def __init__(self, tokens, states):
+        # tag names, indexed by the tag numbers in self.columns
+        self.tags = []
+        numbers = {}
+        # for each token : start, end (-1 for the end of line), tag number
+        self.columns = array('l')
+        # position in self.columns of the first token of each line
+        self.first = array('l', [0])
+        for line in tokens:
+            for start, end, tag in line:
+                if tag not in numbers:
+                    numbers[tag] = len(self.tags)
+                    self.tags.append(tag)
+                self.columns.extend((start, -1 if end is None else end,
+                    numbers[tag]))
+            self.first.append(len(self.columns))
+        self.states = states
+        # for each line of the document, the line of the lexed text (from
+        # 0), None if it was edited since ; None if the document was not
+        # edited
+        self.rows = None
+
+    def __len__(self):
+        return len(self.first) - 1
+
+    def edited(self, first, old_last, new_last):
+        """Lines first to old_last of the document were replaced by lines
+        first to new_last : their tokens are unknown."""
+        if self.rows is None:
+            self.rows = list(range(len(self)))
+        self.rows[first - 1:old_last] = [None] * (new_last - first + 1)
+
+    def lines(self, first, last):
+        """Return the tokens of lines first to last (the first line is 1),
+        as returned by renderer.split_lines(), and the lexer states at the
+        start of the lines after first. The tokens of these lines must be
+        known (see run())."""
+        if self.rows is not None:
+            shift = self.rows[first - 1] - first + 1
+            first, last = first + shift, last + shift
+        tags, columns = self.tags, self.columns
+        tokens = []
+        for line in range(first - 1, last):
+            line_tokens = []
+            for pos in range(self.first[line], self.first[line + 1], 3):
+                end = columns[pos + 1]
+                line_tokens.append((columns[pos], None if end == -1 else end,
+                    tags[columns[pos + 2]]))
+            tokens.append(line_tokens)
+        return tokens, self.states[first - 1:last]
+
+    def run(self, first, last):
+        """Return (known, end) : end is the last line of the lines from first
+        to last whose tokens are all known, or all unknown."""
+        rows = range(len(self)) if self.rows is None else self.rows
+        if first > len(rows):
+            return False, last
+        known = rows[first - 1] is not None
+        end = first
+        while end < min(last, len(rows)) and \
+                (rows[end] is not None) == known:
+            end += 1
+        return known, end
+
+    def state(self, line):
+        """Return the lexer state at the start of line, when the text was
+        lexed. The tokens of the line must be known."""
+        row = line - 1 if self.rows is None else self.rows[line - 1]
+        return None if row == 0 else self.states[row - 1]
+
+
+def enabled(size):
+    """Return True if a text of this size is lexed by the workers."""
+    return max_workers > 0 and size >= min_size
+
+
+def get_lexer(lang):
+    if lang not in lexers:
+        lexers[lang] = lexer.Lexer(importlib.import_module(
+            'languages.{}'.format(lang)))
+    return lexers[lang]
+
+
+def reset():
+    """Stop the processes, for instance because the languages were
+    modified. A new pool is created at the next use."""
+    global pool
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+        pool = None
+
+
+def set_pool(workers, size):
+    """Lex the texts of at least size characters in a pool of workers
+    processes. Lexing in processes is disabled if workers is 0."""
+    global max_workers, min_size
+    reset()
+    max_workers, min_size = workers, size
+
+
+def spans(future):
+    """Return the spans and lexer states of a result of submit_spans()."""
+    (tags, columns), states = future.result()
+    return [(columns[pos], columns[pos + 1], tags[columns[pos + 2]])
+        for pos in range(0, len(columns), 3)], states
+
+
+def spawning(func, *args):
+    """Return func(*args), where func may start spawned processes. It can
+    be called by several threads at the same time."""
+    # the spawned processes run the main module, that is the editor, unless
+    # it has a module spec named __main__ : set one while the processes are
+    # started, and restore the original one when the last call returns
+    global nb_spawning, main_spec
+    main = sys.modules['__main__']
+    with spawning_lock:
+        if nb_spawning == 0:
+            main_spec = getattr(main, '__spec__', None)
+            main.__spec__ = types.SimpleNamespace(name='__main__')
+        nb_spawning += 1
+    try:
+        return func(*args)
+    finally:
+        with spawning_lock:
+            nb_spawning -= 1
+            if nb_spawning == 0:
+                main.__spec__ = main_spec
+
+
+def submit(func, *args):
+    """Run func(*args) in the pool, return a Future."""
+    global pool
+    if pool is None:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers,
+            mp_context=multiprocessing.get_context('spawn'))
+    return spawning(pool.submit, func, *args)
+
+
+def submit_lines(lang, txt):
+    """Lex the whole document txt in a worker ; the result of the future is
+    a LineTokens instance."""
+    return submit(tokenize_lines, lang, txt)
+
+
+def submit_spans(lang, txt):
+    """Lex txt in a worker ; use spans() to read the result of the
+    future."""
+    return submit(tokenize, lang, txt)
+
+
+def tokenize(lang, txt):
+    """Run in a worker process."""
+    spans, states = get_lexer(lang).tokenize(txt)
+    tags = sorted(set(span[2] for span in spans))
+    numbers = {tag: num for num, tag in enumerate(tags)}
+    columns = array('l')
+    for start, end, tag in spans:
+        columns.extend((start, end, numbers[tag]))
+    return (tags, columns), states
+
+
+def tokenize_lines(lang, txt):
+    """Run in a worker process."""
+    if not txt.endswith('\n'):
+        txt += '\n'
+    spans, states = get_lexer(lang).tokenize(txt)
+    lines = lineindex.LineIndex(txt)
+    tokens = renderer.split_lines(spans, lines)[:-1]
+    renderer.mark_too_long(tokens, lines)
+    return LineTokens(tokens, states)